@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import main
+from compute import init_worker
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+# Function to list the image files under a directory in a stable order
+def iter_image_paths(directory, recursive=True):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+        if not recursive:
+            break
+
+
+# Function to analyze one image file and build its JSONL record
+def process_image(path, n_clusters=3, engine=main.DEFAULT_ENGINE, max_pixels=main.DEFAULT_MAX_PIXELS,
+                  decode_pixels=main.DECODE_MAX_PIXELS, mask_skin=True, hair_colors=None, eye_colors=None):
+    record = {"path": path}
+    timings = {}
+    try:
+        # Each batch worker analyses one image at a time, so the peak covers this image only
+        main.reset_peak_rss()
+        start = time.perf_counter()
+        image = main.load_image(path, decode_pixels)
+        timings["decode"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        analysis = main.analyze_skin_tone(image, n_clusters, max_pixels, engine=engine, mask_skin=mask_skin)
+        timings["analyze"] = time.perf_counter() - start
+        timings.update(analysis["timings"])
+
+        # Palettes for every requested hair/eye combination of the detected undertone
+        start = time.perf_counter()
+        palettes = {}
+        for hair_color in hair_colors or main.HAIR_COLORS:
+            for eye_color in eye_colors or main.EYE_COLORS:
+                colors = main.get_recommended_colors(analysis["undertone"], hair_color, eye_color)
+                palettes[f"{hair_color}/{eye_color}"] = [
+                    {"name": color["Color Name"], "rgb": list(color["RGB"]), "hex": color["Hex"]}
+                    for color in colors
+                ]
+        timings["lookup"] = time.perf_counter() - start
+
+        record.update({
+            "undertone": analysis["undertone"],
+            "skin_tone": list(analysis["skin_tone"]),
+            "centers": np.asarray(analysis["centers"], dtype=np.float64).round(2).tolist(),
+            "weights": np.asarray(analysis["weights"], dtype=np.float64).round(6).tolist(),
+            "undertone_votes": analysis["undertone_votes"],
+            "n_pixels": analysis["n_pixels"],
+            "n_skin": analysis["n_skin"],
+            "k_selection": analysis["k_selection"],
+            "peak_rss_bytes": main.peak_rss_bytes(),
+            "palettes": palettes,
+            "error": None,
+        })
+    except Exception as exc:
+        record["error"] = f"{type(exc).__name__}: {exc}"
+    record["timings"] = timings
+    return record
+
+
+# Function to read the paths that already finished successfully in an earlier run.
+# A record cut off by a crash is dropped from the file so new records append cleanly.
+def load_completed(output_path):
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("error") is None:
+            completed.add(record["path"])
+    return completed
+
+
+# Function to stream image paths through a process pool and write one JSONL record per image
+def run_batch(paths, output_path, workers=None, max_in_flight=None, resume=False, **options):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    completed = load_completed(output_path) if resume else set()
+    counts = {"processed": 0, "errors": 0, "skipped": 0}
+
+    start = time.perf_counter()
+    with open(output_path, "a" if resume else "w") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                counts["processed"] += 1
+                if record["error"] is not None:
+                    counts["errors"] += 1
+            out.flush()
+
+        for path in paths:
+            if path in completed:
+                counts["skipped"] += 1
+                continue
+            # Bound the number of queued tasks so huge directories don't pile up in memory
+            if len(pending) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+            pending.add(pool.submit(process_image, path, **options))
+
+        if pending:
+            drain(ALL_COMPLETED)
+
+    counts["seconds"] = time.perf_counter() - start
+    counts["images_per_second"] = counts["processed"] / counts["seconds"] if counts["seconds"] else 0.0
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Classify skin undertone for a directory of images.")
+    parser.add_argument("directory", help="Directory to scan for .jpg/.jpeg/.png images")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file to write records to")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Maximum queued tasks (default: 4 per worker)")
+    parser.add_argument("--resume", action="store_true", help="Skip images already recorded in the output file")
+    parser.add_argument("--no-recursive", action="store_true", help="Only scan the top-level directory")
+    parser.add_argument("--n-clusters", type=main.parse_n_clusters, default=3, help='A number, or "auto"')
+    parser.add_argument("--engine", choices=sorted(main.CLUSTER_ENGINES), default=main.DEFAULT_ENGINE)
+    parser.add_argument("--max-pixels", type=int, default=main.DEFAULT_MAX_PIXELS)
+    parser.add_argument("--decode-pixels", type=int, default=main.DECODE_MAX_PIXELS)
+    parser.add_argument("--no-skin-mask", action="store_true", help="Cluster all pixels instead of skin candidates")
+    parser.add_argument("--hair", action="append", choices=main.HAIR_COLORS, help="Hair colour(s) to include palettes for")
+    parser.add_argument("--eye", action="append", choices=main.EYE_COLORS, help="Eye colour(s) to include palettes for")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = run_batch(
+        iter_image_paths(args.directory, recursive=not args.no_recursive),
+        args.output,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        resume=args.resume,
+        n_clusters=args.n_clusters,
+        engine=args.engine,
+        max_pixels=args.max_pixels,
+        decode_pixels=args.decode_pixels,
+        mask_skin=not args.no_skin_mask,
+        hair_colors=args.hair,
+        eye_colors=args.eye,
+    )
+    print(json.dumps(summary), file=sys.stderr)
@@ -0,0 +1,276 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import main
+
+DEFAULT_SIZES = [0.3, 2, 8, 12, 24]
+
+
+# Function to generate a synthetic face-like photo: a background gradient, hair,
+# a skin-coloured face ellipse with shading, and eyes. It is drawn at a small
+# size and upscaled so that even 24 MP images are generated quickly.
+def make_face_image(megapixels, seed=0):
+    rng = np.random.default_rng(seed)
+    width = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(megapixels * 1e6 / width)
+    small_w, small_h = max(width // 4, 64), max(height // 4, 48)
+
+    y = np.linspace(0, 1, small_h, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, small_w, dtype=np.float32)[None, :]
+    background = np.stack([90 + 60 * x + 0 * y, 110 + 40 * y + 0 * x, 150 + 50 * x * y], axis=2)
+    canvas = Image.fromarray(background.clip(0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(canvas)
+    cx, cy = small_w / 2, small_h / 2
+    fw, fh = small_w * 0.22, small_h * 0.36
+    draw.ellipse([cx - fw * 1.15, cy - fh * 1.2, cx + fw * 1.15, cy + fh * 0.4], fill=(45, 30, 20))
+    draw.ellipse([cx - fw, cy - fh, cx + fw, cy + fh], fill=(214, 164, 132))
+    for ex in (cx - fw * 0.4, cx + fw * 0.4):
+        draw.ellipse([ex - fw * 0.12, cy - fh * 0.2, ex + fw * 0.12, cy - fh * 0.05], fill=(70, 50, 40))
+
+    pixels = np.asarray(canvas).astype(np.int16)
+    pixels += rng.integers(-8, 9, pixels.shape, dtype=np.int16)
+    canvas = Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+    return canvas.resize((width, height), Image.BILINEAR)
+
+
+# Function to encode a synthetic image as JPEG bytes, like an upload
+def make_upload(megapixels, seed=0, quality=90):
+    buf = io.BytesIO()
+    make_face_image(megapixels, seed).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+# Function to run every pipeline stage once and return how long each stage took
+def run_stages(data, engine=main.DEFAULT_ENGINE, n_clusters=3, hair_color="Black", eye_color="Brown"):
+    timings = {}
+    start = time.perf_counter()
+
+    image = main.load_image(data)
+    timings["decode"] = time.perf_counter() - start
+
+    mark = time.perf_counter()
+    pixel_data = main.image_to_array(image).reshape((-1, 3))
+    timings["reshape"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    candidates, _ = main.select_skin_pixels(pixel_data)
+    timings["mask"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    sampled = main.sample_pixels(candidates)
+    timings["sample"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    centers, counts = main.CLUSTER_ENGINES[engine](sampled, n_clusters)
+    timings["cluster"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    undertone = main.classify_undertone(centers.astype(int)[np.argmax(counts)])
+    timings["classify"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    colors = main.get_recommended_colors(undertone, hair_color, eye_color)
+    timings["lookup"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    main.display_colors_grid(colors)
+    timings["render"] = time.perf_counter() - mark
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+# Function to measure the peak traced allocation of one full pipeline run
+def measure_peak_memory(data, **options):
+    tracemalloc.start()
+    try:
+        run_stages(data, **options)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# Function to measure how far one full pipeline run raises the process's peak RSS.
+# Returns None where the peak can't be reset (non-Linux).
+def measure_peak_rss(data, **options):
+    if not main.reset_peak_rss():
+        return None
+    before = main.peak_rss_bytes()
+    run_stages(data, **options)
+    return main.peak_rss_bytes() - before
+
+
+# Function to profile the import time of a module in a fresh interpreter with -X importtime.
+# Returns the total and the `top` slowest imports by cumulative time, in seconds.
+def profile_imports(module="main", top=15):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        entries.append({"module": name, "self_s": int(self_us) / 1e6, "cumulative_s": int(cumulative_us) / 1e6})
+
+    total = next((entry["cumulative_s"] for entry in entries if entry["module"] == module), None)
+    entries.sort(key=lambda entry: entry["cumulative_s"], reverse=True)
+    return {"module": module, "total_s": total, "slowest": entries[:top]}
+
+
+# Function to benchmark the pipeline at each image size
+def run_benchmark(sizes=DEFAULT_SIZES, repeats=5, engine=main.DEFAULT_ENGINE, seed=0):
+    results = []
+    for megapixels in sizes:
+        data = make_upload(megapixels, seed)
+
+        # Warm up once so lazy imports and caches don't count against the first size
+        run_stages(data, engine=engine)
+        runs = [run_stages(data, engine=engine) for _ in range(repeats)]
+
+        stages = {}
+        for stage in runs[0]:
+            samples = [run[stage] for run in runs]
+            stages[stage] = {"median_s": statistics.median(samples), "min_s": min(samples)}
+        results.append({
+            "megapixels": megapixels,
+            "upload_bytes": len(data),
+            "stages": stages,
+            "peak_traced_bytes": measure_peak_memory(data, engine=engine),
+            "peak_rss_delta_bytes": measure_peak_rss(data, engine=engine),
+        })
+
+    return {
+        "meta": {
+            "engine": engine,
+            "repeats": repeats,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "max_rss_bytes": main.peak_rss_bytes(),
+        },
+        "results": results,
+    }
+
+
+# Function to compare clustering engines with a reference engine over several synthetic
+# images per size: undertone agreement rate, skin tone shift and median latency
+def compare_engine_accuracy(engines, sizes=DEFAULT_SIZES, variants=3, reference_engine=main.DEFAULT_ENGINE,
+                            max_pixels=main.DEFAULT_MAX_PIXELS):
+    # Warm up the lazy imports so they don't count against the first comparison
+    main.compare_engines(make_face_image(0.1), engines[0], reference_engine, max_pixels=max_pixels)
+
+    summary = []
+    for engine in engines:
+        comparisons = []
+        for megapixels in sizes:
+            for seed in range(variants):
+                image = main.load_image(make_upload(megapixels, seed))
+                comparisons.append(main.compare_engines(image, engine, reference_engine, max_pixels=max_pixels))
+
+        summary.append({
+            "engine": engine,
+            "reference_engine": reference_engine,
+            "images": len(comparisons),
+            "undertone_agreement": sum(c["undertone_agrees"] for c in comparisons) / len(comparisons),
+            "median_skin_tone_shift": statistics.median(c["skin_tone_shift"] for c in comparisons),
+            "max_skin_tone_shift": max(c["skin_tone_shift"] for c in comparisons),
+            "median_s": statistics.median(c["seconds"] for c in comparisons),
+            "reference_median_s": statistics.median(c["reference_seconds"] for c in comparisons),
+        })
+    return summary
+
+
+# Function to compare a run with a stored baseline. A stage regresses when its median
+# is more than `threshold` slower (relative) and `min_seconds` slower (absolute).
+def compare_to_baseline(current, baseline, threshold=0.25, min_seconds=0.002):
+    regressions = []
+    baseline_by_size = {entry["megapixels"]: entry for entry in baseline["results"]}
+    for entry in current["results"]:
+        reference = baseline_by_size.get(entry["megapixels"])
+        if reference is None:
+            continue
+        for stage, stats in entry["stages"].items():
+            if stage not in reference["stages"]:
+                continue
+            before = reference["stages"][stage]["median_s"]
+            after = stats["median_s"]
+            if after > before * (1 + threshold) and after - before > min_seconds:
+                regressions.append({
+                    "megapixels": entry["megapixels"],
+                    "stage": stage,
+                    "baseline_s": before,
+                    "current_s": after,
+                    "ratio": after / before if before else float("inf"),
+                })
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the skin tone analysis pipeline.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="Image sizes in megapixels")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--engine", choices=sorted(main.CLUSTER_ENGINES), default=main.DEFAULT_ENGINE)
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown per stage")
+    parser.add_argument("--imports", action="store_true", help="Report import times of the app and the lazy engine")
+    parser.add_argument("--min-seconds", type=float, default=0.002, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--compare-engines", nargs="+", choices=sorted(main.CLUSTER_ENGINES), metavar="ENGINE",
+                        help="Compare the accuracy and latency of these engines against --engine instead")
+    parser.add_argument("--variants", type=int, default=3, help="Images per size for --compare-engines")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.imports:
+        for module in ("main", "sklearn.cluster"):
+            profile = profile_imports(module)
+            print(f"import {module}: {profile['total_s'] * 1000:.0f}ms")
+            for entry in profile["slowest"][:8]:
+                print(f"  {entry['cumulative_s'] * 1000:8.1f}ms  {entry['module']}")
+        sys.exit(0)
+
+    if args.compare_engines:
+        for entry in compare_engine_accuracy(args.compare_engines, args.sizes, args.variants, args.engine):
+            print(f"{entry['engine']:>14} vs {entry['reference_engine']}: "
+                  f"agreement={entry['undertone_agreement']:.0%}  "
+                  f"skin shift median={entry['median_skin_tone_shift']:.1f} max={entry['max_skin_tone_shift']:.1f}  "
+                  f"{entry['median_s'] * 1000:.1f}ms vs {entry['reference_median_s'] * 1000:.1f}ms")
+        sys.exit(0)
+
+    report = run_benchmark(args.sizes, args.repeats, args.engine)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for entry in report["results"]:
+        stages = "  ".join(f"{name}={stats['median_s'] * 1000:.1f}ms" for name, stats in entry["stages"].items())
+        print(f"{entry['megapixels']:>5} MP  {stages}  peak={entry['peak_traced_bytes'] / 1e6:.1f}MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.threshold, args.min_seconds)
+        for regression in regressions:
+            print(f"REGRESSION {regression['megapixels']} MP {regression['stage']}: "
+                  f"{regression['baseline_s'] * 1000:.1f}ms -> {regression['current_s'] * 1000:.1f}ms "
+                  f"({regression['ratio']:.2f}x)", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Function to build a content-addressed cache key from the uploaded bytes and analysis settings
+def make_cache_key(data, **settings):
+    digest = hashlib.sha256(data).hexdigest()
+    parts = [f"{name}={settings[name]}" for name in sorted(settings)]
+    return digest + ("|" + "|".join(parts) if parts else "")
+
+
+# Function to estimate how many bytes a cached analysis result holds
+def estimate_size(value):
+    size = 0
+    for item in value.values():
+        if isinstance(item, np.ndarray):
+            size += item.nbytes
+        else:
+            size += 64
+    return size
+
+
+# In-memory LRU cache of analysis results with an optional on-disk tier. The disk tier
+# holds at most disk_max_bytes: when a write takes it over, the least recently used
+# files (by mtime, which a disk hit refreshes) are deleted. A failed disk write (disk
+# full, read-only mount) is counted and the result stays cached in memory only.
+class AnalysisCache:
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_write_errors = 0
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.disk_dir, name + ".pkl")
+
+    # Function to list the disk tier's entries as (mtime, size, path)
+    def _disk_files(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    # Function to delete the least recently used disk entries until the tier is at 90% of
+    # disk_max_bytes, so the next few writes don't each rescan the directory. Other
+    # processes may share the directory, so it is re-measured first.
+    def _evict_disk(self):
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= 0.9 * self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.disk_evictions += 1
+        self._disk_bytes = total
+
+    def _store(self, key, value):
+        size = estimate_size(value)
+        if key in self._entries:
+            self._bytes -= self._sizes[key]
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self._bytes += size
+
+        # Evict least recently used entries until both bounds hold again
+        while len(self._entries) > self.max_entries or (self._bytes > self.max_bytes and len(self._entries) > 1):
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                os.utime(path)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._store(key, value)
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+        if self.disk_dir:
+            # Write to a temporary file and rename so readers never see a partial entry
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path)
+            except OSError:
+                with self._disk_lock:
+                    self.disk_write_errors += 1
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return
+            with self._disk_lock:
+                self._disk_bytes += size
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._evict_disk()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.disk_evictions,
+                "disk_write_errors": self.disk_write_errors,
+            }
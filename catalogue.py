@@ -0,0 +1,181 @@
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+import warnings
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import numpy as np
+
+# Catalogue file layout (little-endian): a 32-byte header, then fixed-width sections,
+# each starting on an 8-byte boundary so it can be viewed in place from a memory map:
+#   palettes        n_palettes x (undertone, hair, eye, first_color, n_colors) uint32
+#   color_names     n_colors uint32 string ids
+#   color_rgb       n_colors x 3 uint8
+#   string_offsets  (n_strings + 1) uint32 offsets into string_data
+#   string_data     UTF-8 bytes of every distinct string, stored once
+MAGIC = b"PCAT"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIII8x")
+PALETTE_DTYPE = np.dtype([("undertone", "<u4"), ("hair", "<u4"), ("eye", "<u4"),
+                          ("first_color", "<u4"), ("n_colors", "<u4")])
+
+
+# Function to round a section length up to the next 8-byte boundary
+def aligned(size):
+    return -(-size // 8) * 8
+
+
+# Function to write a palette index ({(undertone, hair, eye): colours}) as a catalogue
+# file. The file is written next to the target and renamed over it, so processes
+# reading the old catalogue keep their mapping and new readers see the whole new one.
+def write_catalogue(palette_index, path):
+    strings = {}
+
+    def string_id(text):
+        return strings.setdefault(text, len(strings))
+
+    palettes = np.zeros(len(palette_index), dtype=PALETTE_DTYPE)
+    names = []
+    rgb = []
+    for i, ((undertone, hair_color, eye_color), colors) in enumerate(palette_index.items()):
+        palettes[i] = (string_id(undertone), string_id(hair_color), string_id(eye_color), len(names), len(colors))
+        for color in colors:
+            names.append(string_id(color["Color Name"]))
+            rgb.append(color["RGB"])
+
+    encoded = [text.encode("utf-8") for text in strings]
+    offsets = np.concatenate([[0], np.cumsum([len(data) for data in encoded])]).astype("<u4")
+    sections = [
+        palettes.tobytes(),
+        np.array(names, dtype="<u4").tobytes(),
+        np.array(rgb, dtype=np.uint8).reshape((-1, 3)).tobytes(),
+        offsets.tobytes(),
+        b"".join(encoded),
+    ]
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(palettes), len(names), len(strings), int(offsets[-1])))
+        for section in sections:
+            f.write(section + b"\0" * (aligned(len(section)) - len(section)))
+    os.replace(tmp_path, path)
+
+
+# Read-only palette catalogue backed by a memory-mapped file. The arrays are views into
+# the mapping, so processes that open the same file share its pages through the OS page
+# cache instead of each holding a parsed copy. It behaves like the in-memory palette
+# index: a mapping of (undertone, hair, eye) to a tuple of colour mappings.
+class PaletteCatalogue(Mapping):
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        # A plain ndarray view of the mapping; indexing it is much cheaper than indexing a memmap
+        self._buffer = np.asarray(np.memmap(path, dtype=np.uint8, mode="r"))
+        if len(self._buffer) < HEADER.size:
+            raise ValueError(f"{path} is truncated")
+
+        magic, version, n_palettes, n_colors, n_strings, string_bytes = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} palette catalogue")
+        self.n_colors = n_colors
+
+        offset = HEADER.size
+        sizes = [n_palettes * PALETTE_DTYPE.itemsize, n_colors * 4, n_colors * 3, (n_strings + 1) * 4, string_bytes]
+        if offset + sum(aligned(size) for size in sizes[:-1]) + string_bytes > len(self._buffer):
+            raise ValueError(f"{path} is truncated")
+        views = []
+        for size in sizes:
+            views.append(self._buffer[offset:offset + size])
+            offset += aligned(size)
+
+        self._palettes = views[0].view(PALETTE_DTYPE)
+        self._color_names = views[1].view("<u4")
+        self._color_rgb = views[2].reshape((-1, 3))
+        self._string_offsets = views[3].view("<u4")
+        self._string_data = views[4]
+
+        # Only the small palette directory is decoded up front; colours are read on demand
+        self._keys = {}
+        for i, (undertone, hair_color, eye_color, _, _) in enumerate(self._palettes.tolist()):
+            self._keys.setdefault((self.string(undertone), self.string(hair_color), self.string(eye_color)), i)
+
+    # Function to decode one string from the string table
+    def string(self, string_id):
+        start, end = self._string_offsets[string_id], self._string_offsets[string_id + 1]
+        return self._string_data[start:end].tobytes().decode("utf-8")
+
+    def __getitem__(self, key):
+        _, _, _, first, n_colors = self._palettes[self._keys[key]].tolist()
+        colors = []
+        for name_id, (r, g, b) in zip(self._color_names[first:first + n_colors].tolist(),
+                                      self._color_rgb[first:first + n_colors].tolist()):
+            colors.append(MappingProxyType({
+                "Color Name": self.string(name_id),
+                "RGB": (r, g, b),
+                "Hex": f"#{r:02X}{g:02X}{b:02X}",
+            }))
+        return tuple(colors)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# A catalogue file that is reopened when it changes. current() returns the catalogue
+# to use; at most every check_interval seconds it stats the file, and if it was
+# replaced, one caller opens the new file and swaps it in. Callers never wait on a
+# reload: anyone already holding the old catalogue keeps using it (its mapping lives
+# as long as they do), and a file that fails to load leaves the old one in place.
+class ReloadingCatalogue:
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._catalogue = PaletteCatalogue(path)
+        self._next_check = time.monotonic() + check_interval
+        self._reload_lock = threading.Lock()
+
+    def current(self):
+        catalogue = self._catalogue
+        if time.monotonic() < self._next_check or not self._reload_lock.acquire(blocking=False):
+            return catalogue
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            stat = os.stat(self.path)
+            if (stat.st_ino, stat.st_size, stat.st_mtime_ns) != catalogue.version:
+                self._catalogue = catalogue = PaletteCatalogue(self.path)
+                self.reloads += 1
+        except (OSError, ValueError) as exc:
+            self.failed_reloads += 1
+            warnings.warn(f"Keeping the current palette catalogue; reloading {self.path} failed: {exc}")
+        finally:
+            self._reload_lock.release()
+        return catalogue
+
+    def stats(self):
+        catalogue = self._catalogue
+        return {"palettes": len(catalogue), "colors": catalogue.n_colors,
+                "reloads": self.reloads, "failed_reloads": self.failed_reloads}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the built-in palette dataset to a catalogue file.")
+    parser.add_argument("output", help="Catalogue file to write, e.g. palettes.pcat")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    import main
+
+    write_catalogue(main.build_palette_index(main.dataset), args.output)
+    catalogue = PaletteCatalogue(args.output)
+    print(f"Wrote {len(catalogue)} palettes, {catalogue.n_colors} colours to {args.output}", file=sys.stderr)
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+
+# Cap on the default worker count: every worker imports its own numpy, scipy and
+# scikit-learn, about 250 MB of RSS, so one per host core can exhaust a container
+DEFAULT_MAX_WORKERS = 4
+
+
+# Function to pick the default number of worker processes: the CPUs this process may
+# run on (os.cpu_count() reports the host's in a container), capped
+def default_workers():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, DEFAULT_MAX_WORKERS))
+
+
+# Raised when the queue of waiting requests is full
+class PoolBusyError(RuntimeError):
+    pass
+
+
+# Function to prepare a worker process: cap its BLAS/OpenMP threads so concurrent
+# fits don't oversubscribe the CPUs, and preload the clustering engine
+def init_worker(threads_per_worker=1, warm_up=True):
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(threads_per_worker)
+    if warm_up:
+        import main
+
+        main.warm_up_clustering()
+
+
+# Function to analyze image bytes inside a worker process. It lives here rather than
+# in main.py because Streamlit runs main.py as __main__, which workers can't import.
+def analyze_in_worker(data, options):
+    import main
+
+    return main.analyze_bytes(data, **options)
+
+
+# Process-wide pool of analysis workers with a bounded FIFO wait queue.
+# At most `workers` requests run at once; up to `max_queued` more wait in order,
+# and anything beyond that is rejected with PoolBusyError. A request gives up after
+# `timeout` seconds in a worker with concurrent.futures.TimeoutError. A worker that
+# dies (e.g. killed for memory) breaks the executor for good, so it is replaced: the
+# requests that were running fail with BrokenExecutor, later ones use the new workers.
+class ComputePool:
+    def __init__(self, workers=None, threads_per_worker=1, max_queued=64, timeout=120):
+        self.workers = workers or default_workers()
+        self.threads_per_worker = threads_per_worker
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._executor = self._new_executor()
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _new_executor(self):
+        # Spawn rather than fork: the Streamlit server process is multi-threaded
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.threads_per_worker,),
+        )
+
+    # Function to replace a broken executor; only the first caller for it starts a new one
+    def _restart(self, broken):
+        with self._cond:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+            self.restarts += 1
+        broken.shutdown(wait=False)
+
+    # Function to run fn(*args) in a worker, waiting for a free slot in FIFO order.
+    # on_wait(position) is called whenever the caller's 1-based queue position changes.
+    def run(self, fn, *args, on_wait=None):
+        ticket = object()
+        with self._cond:
+            if len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                raise PoolBusyError(f"{len(self._waiting)} requests already waiting")
+            self._waiting.append(ticket)
+
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    if self._running < self.workers and self._waiting[0] is ticket:
+                        self._waiting.popleft()
+                        self._running += 1
+                        # The next waiter is now first in line and may have a free slot
+                        self._cond.notify_all()
+                        break
+                    position = self._waiting.index(ticket) + 1
+                    if position == last_position:
+                        self._cond.wait(timeout=0.5)
+                        continue
+                if on_wait is not None:
+                    on_wait(position)
+                last_position = position
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._cond.notify_all()
+            raise
+
+        executor = self._executor
+        try:
+            try:
+                job = executor.submit(fn, *args)
+            except BrokenExecutor:
+                # The pool broke since the last request; this one can run on a new pool
+                self._restart(executor)
+                executor = self._executor
+                job = executor.submit(fn, *args)
+            try:
+                return job.result(timeout=self.timeout)
+            except BrokenExecutor:
+                self._restart(executor)
+                raise
+        finally:
+            with self._cond:
+                self._running -= 1
+                self.completed += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": len(self._waiting),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,86 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+from bench import make_upload
+
+
+# Function to report p50/p95/p99 and throughput from a list of request latencies
+def summarize(latencies, errors, seconds):
+    latencies = np.sort(np.asarray(latencies))
+    summary = {"requests": len(latencies), "errors": errors, "seconds": seconds,
+               "requests_per_second": len(latencies) / seconds if seconds else 0.0}
+    if len(latencies):
+        summary.update({
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "max_ms": float(latencies[-1] * 1000),
+        })
+    return summary
+
+
+# Function to drive the analysis service with `concurrency` keep-alive clients until
+# `total` requests have been sent, cycling through the given image payloads
+def run_load(url, payloads, concurrency=8, total=200, hair="Black", eye="Brown"):
+    target = urlparse(url)
+    path = f"/analyze?hair={hair}&eye={eye}"
+    latencies = []
+    errors = [0]
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            body = payloads[index % len(payloads)]
+            start = time.perf_counter()
+            try:
+                connection.request("POST", path, body=body, headers={"Content-Type": "application/octet-stream"})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the HTTP analysis service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.3, 2], help="Image sizes in megapixels")
+    parser.add_argument("--variants", type=int, default=4, help="Distinct images per size")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    payloads = [make_upload(size, seed) for size in args.sizes for seed in range(args.variants)]
+    print(json.dumps(run_load(args.url, payloads, args.concurrency, args.requests), indent=2))
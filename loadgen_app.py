@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import main
+from bench import make_upload
+from loadgen import summarize
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Function to read CPU seconds and current/peak RSS of a process from /proc (Linux only)
+def process_usage(pid="self"):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage = {"cpu_seconds": (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_bytes" if line.startswith("VmRSS:") else "peak_rss_bytes"
+                    usage[key] = int(line.split()[1]) * 1024
+        return usage
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# Function to list the child processes of a process, i.e. the server's compute pool workers
+def child_pids(pid="self"):
+    pids = set()
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.update(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(pids)
+
+
+# Function to snapshot CPU and memory of the app server process and each worker process
+def snapshot_usage(pid="self"):
+    return {"app": process_usage(pid), "workers": {child: process_usage(child) for child in child_pids(pid)}}
+
+
+# Function to turn two usage snapshots into CPU utilisation and RSS per process
+def usage_report(before, after, seconds):
+    def report(start, end):
+        if end is None:
+            return None
+        cpu = end["cpu_seconds"] - (start["cpu_seconds"] if start else 0.0)
+        return {"cpu_percent": 100 * cpu / seconds if seconds else 0.0,
+                "rss_mb": end.get("rss_bytes", 0) / 1e6, "peak_rss_mb": end.get("peak_rss_bytes", 0) / 1e6}
+
+    workers = {pid: report(before["workers"].get(pid), usage) for pid, usage in after["workers"].items()}
+    return {"app": report(before["app"], after["app"]),
+            "workers": {pid: usage for pid, usage in workers.items() if usage is not None}}
+
+
+# Function to pick a free local TCP port for the server
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Function to start `streamlit run main.py` headless on a port and wait until it is
+# healthy. XSRF protection is off because the simulated browsers have no cookies.
+def start_server(port, workers=None, timeout=60):
+    env = dict(os.environ)
+    if workers is not None:
+        env["COMPUTE_WORKERS"] = str(workers)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "main.py", "--server.headless", "true",
+         "--server.port", str(port), "--server.enableXsrfProtection", "false",
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/_stcore/health")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"streamlit didn't become healthy within {timeout} s")
+
+
+# Function to upload a file to the server the way the browser's file uploader does
+def put_file(port, upload_url, data, name):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    connection.request("PUT", upload_url, body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    response = connection.getresponse()
+    response.read()
+    if response.status >= 300:
+        raise RuntimeError(f"upload failed with HTTP {response.status}")
+
+
+# A headless browser session: one websocket to the server speaking Streamlit's protobuf
+# protocol. It learns the widget ids from each run, uploads images through the upload
+# endpoint and reruns the script with the widget states a user's clicks would send.
+class BrowserSession:
+    def __init__(self, port, timeout=120):
+        self.port = port
+        self.timeout = timeout
+        self.session_id = None
+        self.widgets = {}
+        self._websocket = None
+
+    async def connect(self):
+        import websockets
+
+        self._websocket = await websockets.connect(f"ws://127.0.0.1:{self.port}/_stcore/stream", max_size=None)
+        return await self.rerun([])
+
+    async def close(self):
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    async def _send(self, back_msg):
+        await self._websocket.send(back_msg.SerializeToString())
+
+    async def _receive(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        forward_msg = ForwardMsg()
+        forward_msg.ParseFromString(await asyncio.wait_for(self._websocket.recv(), self.timeout))
+        return forward_msg
+
+    # Function to run the script with the given widget states; True when the run
+    # finished without an exception or an error message on the page
+    async def rerun(self, widget_states):
+        from streamlit.proto.Alert_pb2 import Alert
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        back_msg = BackMsg()
+        back_msg.rerun_script.widget_states.widgets.extend(widget_states)
+        await self._send(back_msg)
+        ok = True
+        while True:
+            forward_msg = await self._receive()
+            kind = forward_msg.WhichOneof("type")
+            if kind == "new_session" and forward_msg.new_session.HasField("initialize"):
+                self.session_id = forward_msg.new_session.initialize.session_id
+            elif kind == "delta" and forward_msg.delta.WhichOneof("type") == "new_element":
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                widget = getattr(element, element_type)
+                if getattr(widget, "id", "") and getattr(widget, "label", ""):
+                    self.widgets[widget.label] = widget.id
+                if element_type == "exception" or (element_type == "alert" and widget.format == Alert.ERROR):
+                    ok = False
+            elif kind == "script_finished":
+                if forward_msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    return False
+                if forward_msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return ok
+
+    # Function to upload image bytes and return the uploader widget state referring to them
+    async def upload(self, data, name):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.Common_pb2 import UploadedFileInfo
+
+        back_msg = BackMsg()
+        back_msg.file_urls_request.request_id = uuid.uuid4().hex
+        back_msg.file_urls_request.file_names.append(name)
+        back_msg.file_urls_request.session_id = self.session_id
+        await self._send(back_msg)
+        while True:
+            forward_msg = await self._receive()
+            response = forward_msg.file_urls_response
+            if forward_msg.WhichOneof("type") == "file_urls_response" \
+                    and response.response_id == back_msg.file_urls_request.request_id:
+                break
+        if response.error_msg:
+            raise RuntimeError(response.error_msg)
+        file_urls = response.file_urls[0]
+        await asyncio.to_thread(put_file, self.port, file_urls.upload_url, data, name)
+        return UploadedFileInfo(name=name, size=len(data), file_id=file_urls.file_id, file_urls=file_urls)
+
+    # Function to do what a user does for one recommendation: upload an image (which
+    # reruns the script, as in the browser), pick hair and eye colours and click the
+    # button. Returns the seconds from the click to the end of the run, or None on error.
+    async def get_recommendations(self, data, name, hair_color, eye_color):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        file_info = await self.upload(data, name)
+        uploader = WidgetState(id=self.widgets["Upload Image"])
+        uploader.file_uploader_state_value.uploaded_file_info.append(file_info)
+        selection = [uploader, WidgetState(id=self.widgets["Select Hair Color"], string_value=hair_color),
+                     WidgetState(id=self.widgets["Select Eye Color"], string_value=eye_color)]
+        await self.rerun(selection)
+
+        start = time.perf_counter()
+        ok = await self.rerun(selection + [WidgetState(id=self.widgets["Get Recommendations"], trigger_value=True)])
+        return time.perf_counter() - start if ok else None
+
+
+# Function to simulate `sessions` concurrent users of one running app server. Every
+# session connects and does one untimed warm-up request first, so the timed part
+# starts with the server and its workers loaded. Each session then uploads a randomly
+# chosen image, picks hair and eye colours and clicks "Get Recommendations" `requests`
+# times; every click is one timed request. A session that fails part way counts every
+# request it didn't complete as an error.
+async def run_sessions(port, server_pid, payloads, sessions=4, requests=5, timeout=120, seed=0):
+    clients = [BrowserSession(port, timeout) for _ in range(sessions)]
+    # A tiny image none of the timed requests uses, so warming up fills no cache entry they hit
+    warm_up_data = make_upload(0.05, seed=10**6)
+
+    async def warm_up(client):
+        try:
+            await client.connect()
+            return await client.get_recommendations(warm_up_data, "warm-up.jpg", main.HAIR_COLORS[0],
+                                                    main.EYE_COLORS[0]) is not None
+        except Exception:
+            return False
+
+    async def session(client, ready, index):
+        rng = random.Random(seed + index)
+        latencies = []
+        for _ in range(requests if ready else 0):
+            payload_index = rng.randrange(len(payloads))
+            try:
+                latency = await client.get_recommendations(payloads[payload_index], f"upload-{payload_index}.jpg",
+                                                           rng.choice(main.HAIR_COLORS), rng.choice(main.EYE_COLORS))
+            except Exception:
+                break
+            if latency is not None:
+                latencies.append(latency)
+        return latencies
+
+    ready = await asyncio.gather(*(warm_up(client) for client in clients))
+    before = snapshot_usage(server_pid)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(session(client, ok, index) for index, (client, ok) in enumerate(zip(clients, ready))))
+    seconds = time.perf_counter() - start
+    after = snapshot_usage(server_pid)
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    latencies = [latency for result in results for latency in result]
+    summary = summarize(latencies, sessions * requests - len(latencies), seconds)
+    summary["sessions"] = sessions
+    summary["usage"] = usage_report(before, after, seconds)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with concurrent simulated sessions.")
+    parser.add_argument("-s", "--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Concurrent sessions; several values sweep for the saturation point")
+    parser.add_argument("-n", "--requests", type=int, default=5, help="Requests per session")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.3, 2, 8], help="Image sizes in megapixels")
+    parser.add_argument("--variants", type=int, default=4,
+                        help="Distinct images per size; fewer means more analysis cache hits")
+    parser.add_argument("-w", "--workers", type=int, help="Compute pool workers (sets COMPUTE_WORKERS)")
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        sys.exit("loadgen_app.py needs websockets: pip install websockets")
+    payloads = [make_upload(size, seed) for size in args.sizes for seed in range(args.variants)]
+
+    results = []
+    for sessions in args.sessions:
+        # Every level gets a new server, so each starts with an empty analysis cache
+        port = free_port()
+        server = start_server(port, args.workers)
+        try:
+            result = asyncio.run(run_sessions(port, server.pid, payloads, sessions, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+        results.append(result)
+        app = result["usage"]["app"] or {}
+        workers = result["usage"]["workers"].values()
+        print(f"{sessions:>3} sessions  {result['requests_per_second']:.2f} req/s  "
+              f"p50={result.get('p50_ms', 0):.0f}ms p95={result.get('p95_ms', 0):.0f}ms "
+              f"p99={result.get('p99_ms', 0):.0f}ms  errors={result['errors']}  "
+              f"app cpu={app.get('cpu_percent', 0):.0f}% rss={app.get('rss_mb', 0):.0f}MB  "
+              f"workers cpu={sum(w['cpu_percent'] for w in workers):.0f}% "
+              f"rss={sum(w['rss_mb'] for w in workers):.0f}MB", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
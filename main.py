@@ -1,9 +1,24 @@
+import html
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import BrokenExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from types import MappingProxyType
 import streamlit as st
 import numpy as np
-from sklearn.cluster import KMeans
-from PIL import Image
-import matplotlib.pyplot as plt
-import seaborn as sns
+from PIL import Image, ImageOps, features
+from cache import AnalysisCache, make_cache_key
+from catalogue import ReloadingCatalogue
+from compute import ComputePool, PoolBusyError, analyze_in_worker, default_workers
+from store import AnalysisStore
+from metrics import ITERATION_BUCKETS, MEMORY_BUCKETS, PIXEL_BUCKETS, MetricsRegistry, start_metrics_server
 # Function to classify the undertone of the dominant color
 def classify_undertone(rgb_color):
     r, g, b = rgb_color
@@ -14,32 +29,715 @@ def classify_undertone(rgb_color):
     else:
         return "Neutral"
 
-# Function to find the dominant skin tone from the image
-def find_dominant_skin_tone(image, n_clusters=3):
+UNDERTONES = ("Warm", "Cool", "Neutral")
+
+# Function to classify the undertone of many colours at once with the same rules
+# as classify_undertone. Takes an (N, 3) array and returns an array of N labels and,
+# optionally, an (N, 3) array of Warm/Cool/Neutral margins: a positive Warm margin
+# means r > g > b by that much, a positive Cool margin means b exceeds r and g by
+# that much, and the Neutral margin is how far the colour is from either rule.
+def classify_undertones(colors, return_scores=False):
+    colors = np.asarray(colors)
+    if colors.dtype == np.uint8:
+        colors = colors.astype(np.int16)
+    r, g, b = colors[:, 0], colors[:, 1], colors[:, 2]
+
+    warm = (r > g) & (g > b)
+    cool = (b > r) & (b > g)
+    labels = np.array(UNDERTONES)[np.where(warm, 0, np.where(cool, 1, 2))]
+    if not return_scores:
+        return labels
+
+    warm_margin = np.minimum(r - g, g - b)
+    cool_margin = np.minimum(b - r, b - g)
+    neutral_margin = -np.maximum(warm_margin, cool_margin)
+    return labels, np.stack([warm_margin, cool_margin, neutral_margin], axis=1)
+
+# Function to vote on the undertone across all clusters, each weighted by its pixel share
+def vote_undertone(centers, weights):
+    labels = classify_undertones(centers)
+    votes = {undertone: float(np.sum(weights[labels == undertone])) for undertone in UNDERTONES}
+    return max(votes, key=votes.get), votes
+
+# Pixel budget for decoding: larger images are decoded or reduced to about this size
+DECODE_MAX_PIXELS = 2_000_000
+
+# Function to convert any PIL image mode (RGBA, P, L, CMYK, ...) to RGB
+def to_rgb(image):
+    if image.mode == "RGB":
+        return image
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    return image.convert("RGB")
+
+# Per-request upload limits: the largest upload accepted, and the most memory the
+# decoder may allocate for one image. Together they bound a request's memory use.
+UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+DECODE_BUDGET_BYTES = 128 * 1024 * 1024
+
+# Raised when an upload is refused before decoding; reason is a short metric label
+class UploadRejected(ValueError):
+    def __init__(self, reason, message):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+# Function to refuse uploads over the byte limit before they are hashed or decoded. Takes
+# the upload, or its length in bytes when the body hasn't been read yet.
+def check_upload_size(data, max_bytes=UPLOAD_MAX_BYTES):
+    size = data if isinstance(data, int) else len(data)
+    if max_bytes and size > max_bytes:
+        raise UploadRejected("too_many_bytes",
+                             f"The file is {size / 2**20:.1f} MB; the limit is {max_bytes / 2**20:.0f} MB.")
+
+# Function to estimate the bytes the decoder will allocate for an opened image. Pillow
+# keeps multi-band images at 4 bytes per pixel, and a non-RGB image needs an RGB copy.
+def decode_bytes(image):
+    pixel_bytes = 1 if image.mode in ("1", "L", "P") else 4
+    copies = 1 if image.mode == "RGB" else 2
+    return image.width * image.height * pixel_bytes * copies
+
+# Function to decode an image at reduced resolution and normalize it to RGB. Only the
+# header is read before the size checks, so oversized images and decompression bombs
+# are rejected without allocating their pixels.
+def load_image(source, max_pixels=DECODE_MAX_PIXELS, budget_bytes=DECODE_BUDGET_BYTES):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        image = Image.open(source)
+    except Image.DecompressionBombError as exc:
+        raise UploadRejected("decompression_bomb", str(exc)) from None
+    width, height = image.size
+
+    # Let the JPEG decoder skip DCT detail and decode directly at 1/2, 1/4 or 1/8 scale:
+    # the smallest of those that fits max_pixels. Pillow picks its scale as
+    # width // requested width, so ask for exactly width // scale.
+    if max_pixels and image.format == "JPEG" and width * height > max_pixels:
+        scale = 2
+        while scale < 8 and -(-width // scale) * -(-height // scale) > max_pixels:
+            scale *= 2
+        image.draft("RGB", (width // scale, height // scale))
+
+    # image.size is now the size the decoder will produce. Pillow can only scale JPEG
+    # while decoding; other formats decode at full size, so they must fit the budget.
+    if budget_bytes and decode_bytes(image) > budget_bytes:
+        raise UploadRejected(
+            "too_many_pixels",
+            f"The image is {width}x{height} pixels, too large to decode; "
+            f"please upload one under {budget_bytes / 4 / 1e6:.0f} megapixels.",
+        )
+
+    # Apply the EXIF orientation and convert to RGB once
+    ImageOps.exif_transpose(image, in_place=True)
+    image = to_rgb(image)
+
+    # Other formats decode at full size (and a JPEG may still be over after 1/8 scale),
+    # so box-reduce by the smallest integer factor that fits max_pixels
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        factor = int(np.ceil(np.sqrt(width * height / max_pixels)))
+        while -(-width // factor) * -(-height // factor) > max_pixels:
+            factor += 1
+        image = image.reduce(factor)
+    return image
+
+# Function to get an image as a contiguous (height, width, 3) uint8 array
+def image_to_array(image):
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image, dtype=np.uint8)
+    # asarray reads the PIL buffer once instead of copying it a second time like np.array
+    return np.asarray(to_rgb(image), dtype=np.uint8)
+
+# Pixel budget for clustering: larger images are subsampled down to this many pixels
+DEFAULT_MAX_PIXELS = 50_000
+SAMPLING_SEED = 42
+
+# Function to subsample the pixels of an image down to a fixed budget
+def sample_pixels(pixel_data, max_pixels=DEFAULT_MAX_PIXELS, seed=SAMPLING_SEED, method="stratified"):
+    n_pixels = len(pixel_data)
+    if max_pixels is None or n_pixels <= max_pixels:
+        return pixel_data
+
+    rng = np.random.default_rng(seed)
+    if method == "stratified":
+        # Split the pixels into max_pixels equal strata (in raster order) and
+        # draw one pixel at random from each, so every region of the image is covered
+        stride = n_pixels / max_pixels
+        offsets = np.arange(max_pixels) * stride + rng.random(max_pixels) * stride
+        indices = np.minimum(offsets.astype(np.intp), n_pixels - 1)
+    elif method == "random":
+        indices = np.sort(rng.choice(n_pixels, size=max_pixels, replace=False))
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    return pixel_data[indices]
+
+# Chroma ranges of skin in YCbCr space (Chai & Ngan) and the minimum share of
+# pixels that must pass before the mask is trusted over the whole image
+SKIN_CB_RANGE = (77, 127)
+SKIN_CR_RANGE = (133, 173)
+MIN_SKIN_FRACTION = 0.05
+
+# Pixels processed per chunk by the vectorized per-pixel stages, so temporary
+# float arrays stay a few MB no matter how large the image is
+CHUNK_PIXELS = 262_144
+
+# Function to flag the pixels whose chroma falls in the skin range, vectorized chunk by chunk
+def skin_mask(pixel_data):
+    # Cb and Cr rows of the RGB -> YCbCr transform
+    coefficients = np.array([[-0.168736, 0.5], [-0.331264, -0.418688], [0.5, -0.081312]], dtype=np.float32)
+    mask = np.empty(len(pixel_data), dtype=bool)
+    for start in range(0, len(pixel_data), CHUNK_PIXELS):
+        chroma = pixel_data[start:start + CHUNK_PIXELS].astype(np.float32) @ coefficients
+        chroma += 128
+        cb, cr = chroma[:, 0], chroma[:, 1]
+        mask[start:start + CHUNK_PIXELS] = ((cb >= SKIN_CB_RANGE[0]) & (cb <= SKIN_CB_RANGE[1]) &
+                                            (cr >= SKIN_CR_RANGE[0]) & (cr <= SKIN_CR_RANGE[1]))
+    return mask
+
+# Function to keep only candidate skin pixels, falling back to all pixels when too few survive
+def select_skin_pixels(pixel_data, min_fraction=MIN_SKIN_FRACTION):
+    mask = skin_mask(pixel_data)
+    n_skin = int(np.count_nonzero(mask))
+    if n_skin < max(1, min_fraction * len(pixel_data)):
+        return pixel_data, False
+    return pixel_data[mask], True
+
+# Function to read the process's peak resident set size in bytes. On Linux this is
+# VmHWM, which reset_peak_rss() can reset; elsewhere it is the lifetime peak.
+def peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Function to reset the peak resident set size so the next reading covers only new work.
+# Only supported on Linux; returns False where the peak can't be reset.
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# Function to bound the error of a cluster's pixel share estimated from a sample.
+# By Hoeffding's inequality the share measured on n_samples pixels is within this
+# distance of the full-image share with the given confidence.
+def sampling_error_bound(n_samples, confidence=0.95):
+    return float(np.sqrt(np.log(2 / (1 - confidence)) / (2 * n_samples)))
+
+# Function to turn previous cluster centres (heaviest first) into exactly n_clusters
+# initial centres: extra old centres are dropped, and missing ones are filled with
+# the data points furthest from the centres kept so far
+def adapt_centers(init_centers, n_clusters, data):
+    centers = np.asarray(init_centers, dtype=data.dtype)[:n_clusters]
+    candidates = data[::max(1, len(data) // 2000)]
+    while len(centers) < n_clusters:
+        distances = np.min(np.linalg.norm(candidates[:, None, :] - centers[None, :, :], axis=2), axis=1)
+        centers = np.vstack([centers, candidates[np.argmax(distances)]])
+    return centers
+
+# Function to fit k-means, warm-started from init_centers when given (a single init
+# instead of k-means++ seeding). Convergence stats are written into `stats` if passed.
+def fit_kmeans(data, n_clusters, sample_weight=None, init_centers=None, stats=None, n_init="auto"):
+    from sklearn.cluster import KMeans  # imported lazily, it is the slowest import of the app
+
+    n_clusters = min(n_clusters, len(data))
+    if init_centers is not None and len(init_centers):
+        init = adapt_centers(init_centers, n_clusters, data)
+        kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, n_init=n_init, random_state=42)
+
+    start = time.perf_counter()
+    kmeans.fit(data, sample_weight=sample_weight)
+    if stats is not None:
+        stats.update({
+            "warm_start": init_centers is not None and len(init_centers) > 0,
+            "n_iter": int(kmeans.n_iter_),
+            "inertia": float(kmeans.inertia_),
+            "fit_seconds": time.perf_counter() - start,
+        })
+    return kmeans
+
+# Function to cluster pixels with k-means and return the centers and pixel counts
+def cluster_pixels(pixel_data, n_clusters=3, init_centers=None, stats=None):
+    # Convert to float32 once; scikit-learn keeps float32 input as is instead of
+    # upcasting uint8 pixels to float64
+    pixel_data = np.asarray(pixel_data, dtype=np.float32)
+
+    n_clusters = min(n_clusters, len(pixel_data))
+    kmeans = fit_kmeans(pixel_data, n_clusters, init_centers=init_centers, stats=stats)
+
+    # Get the cluster centers (dominant colors) and the number of pixels in each.
+    # Only the counts are kept; the per-pixel labels are dropped with the estimator.
+    centers = kmeans.cluster_centers_
+    counts = np.bincount(kmeans.labels_, minlength=n_clusters)
+    return centers, counts
+
+# Function to cluster a quantized colour histogram with weighted k-means.
+# Pixels are binned into (2**bits)^3 colour bins and only the occupied bins are
+# clustered, each weighted by its pixel count, so the cost scales with the number
+# of distinct colours instead of the number of pixels.
+def cluster_histogram(pixel_data, n_clusters=3, init_centers=None, stats=None, bits=5):
+    pixels = np.asarray(pixel_data, dtype=np.uint8)
+    shift = 8 - bits
+    n_bins = 1 << (3 * bits)
+    counts = np.zeros(n_bins, dtype=np.int64)
+    sums = np.zeros((3, n_bins))
+
+    for start in range(0, len(pixels), CHUNK_PIXELS):
+        chunk = pixels[start:start + CHUNK_PIXELS]
+
+        # Pack the quantized r, g, b values into a single bin index per pixel
+        quantized = (chunk >> shift).astype(np.int32)
+        bin_index = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+
+        counts += np.bincount(bin_index, minlength=n_bins)
+        for channel in range(3):
+            sums[channel] += np.bincount(bin_index, weights=chunk[:, channel], minlength=n_bins)
+
+    # Pixel count and mean colour of every occupied bin
+    occupied = np.flatnonzero(counts)
+    bin_counts = counts[occupied]
+    bin_colors = (sums[:, occupied] / bin_counts).T
+
+    # Apply weighted k-means over the occupied bins only
+    n_clusters = min(n_clusters, len(occupied))
+    kmeans = fit_kmeans(bin_colors, n_clusters, sample_weight=bin_counts, init_centers=init_centers, stats=stats)
+
+    # Cluster sizes are the summed pixel counts of their bins
+    cluster_counts = np.bincount(kmeans.labels_, weights=bin_counts, minlength=n_clusters).astype(np.int64)
+    return kmeans.cluster_centers_, cluster_counts
+
+# Pixels per tile for the tiled engine, and the number of clusters summarizing each tile
+TILE_PIXELS = 250_000
+TILE_CLUSTERS_PER_CLUSTER = 4
+
+# Function to summarize one tile as a few weighted k-means centres. The OpenMP thread
+# count is per calling thread, so limiting it here only affects this tile's fit.
+def summarize_tile(tile, n_clusters):
+    from sklearn.cluster import KMeans
+    from threadpoolctl import threadpool_limits
+
+    tile = np.asarray(tile, dtype=np.float32)
+    with threadpool_limits(1, user_api="openmp"):
+        kmeans = KMeans(n_clusters=min(n_clusters, len(tile)), n_init=1, random_state=42).fit(tile)
+    return kmeans.cluster_centers_, np.bincount(kmeans.labels_, minlength=kmeans.n_clusters)
+
+# Function to cluster every skin candidate pixel (see UNSAMPLED_ENGINES) map-reduce style,
+# instead of the clustering sample. The pixels are split into row-band tiles, each tile
+# is summarized in parallel by TILE_CLUSTERS_PER_CLUSTER * n_clusters centres, and a
+# weighted k-means over all tile centres gives the final clusters. Decoding caps images
+# at DECODE_MAX_PIXELS, so there are at most about 8 tiles. It is slower than the default,
+# not faster: on one core 3-13x the sampled k-means (about 1 s against 80 ms at 2 MP),
+# less with a core per tile. Measure its accuracy with compare_engines.
+def cluster_tiled(pixel_data, n_clusters=3, init_centers=None, stats=None, tile_pixels=TILE_PIXELS, workers=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    # At least one tile per worker, and no tile larger than tile_pixels
+    workers = workers or os.cpu_count() or 1
+    n_tiles = max(workers, -(-len(pixel_data) // tile_pixels))
+    size = max(1, -(-len(pixel_data) // n_tiles))
+    tiles = [pixel_data[start:start + size] for start in range(0, len(pixel_data), size)]
+    tile_clusters = n_clusters * TILE_CLUSTERS_PER_CLUSTER
+
+    # Map: the fits release the GIL, so threads run them on all cores without copying
+    # tiles to other processes
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(lambda tile: summarize_tile(tile, tile_clusters), tiles))
+
+    # Reduce: weighted k-means over the tile centres; there are only a few hundred of
+    # them, so several restarts are cheap
+    centers = np.concatenate([tile_centers for tile_centers, _ in summaries])
+    weights = np.concatenate([tile_counts for _, tile_counts in summaries])
+    kmeans = fit_kmeans(centers, n_clusters, sample_weight=weights, init_centers=init_centers, stats=stats,
+                        n_init=10)
+    counts = np.bincount(kmeans.labels_, weights=weights, minlength=kmeans.n_clusters).astype(np.int64)
+    if stats is not None:
+        stats["tiles"] = len(tiles)
+    return kmeans.cluster_centers_, counts
+
+# Function to cluster pixels with one of Pillow's C quantizers (median cut, fast octree
+# or libimagequant). The palette entries are the centres and the quantized pixel counts
+# are the cluster sizes. There is no iterative fit, so init_centers is not used.
+def cluster_quantize(pixel_data, n_clusters=3, init_centers=None, stats=None, method=Image.Quantize.FASTOCTREE):
+    pixels = np.ascontiguousarray(pixel_data, dtype=np.uint8)
+    n_clusters = min(n_clusters, len(pixels))
+
+    # Quantize the pixel list as a one-row image
+    quantized = Image.fromarray(pixels.reshape((1, -1, 3))).quantize(n_clusters, method=method)
+    counts = np.bincount(np.asarray(quantized).ravel(), minlength=n_clusters)[:n_clusters]
+    palette = np.array(quantized.getpalette()[:3 * n_clusters], dtype=np.float64).reshape((-1, 3))
+
+    # Drop palette entries no pixel was mapped to
+    used = np.flatnonzero(counts[:len(palette)])
+    return palette[used], counts[used].astype(np.int64)
+
+# Automatic cluster count: candidate range, pixels scored per candidate, and the time
+# budget for trying candidates (seconds)
+AUTO_K_RANGE = (2, 6)
+AUTO_K_SAMPLE = 4_000
+AUTO_K_BUDGET = 0.1
+
+# Function to score a clustering with the simplified silhouette: for each point, how
+# much closer it is to its own centre than to the next nearest one. Unlike the full
+# silhouette it needs no pairwise distances, so it costs O(n * k).
+def silhouette_score(data, centers, labels):
+    distances = np.linalg.norm(data[:, None, :] - centers[None, :, :], axis=2)
+    rows = np.arange(len(data))
+    own = distances[rows, labels]
+    distances[rows, labels] = np.inf
+    other = distances.min(axis=1)
+    return float(np.mean((other - own) / np.maximum(np.maximum(own, other), 1e-9)))
+
+# Function to pick the number of clusters for a set of pixels. Candidates are fitted in
+# increasing k on a small sample, each warm-started from the previous fit's centres plus
+# the furthest pixel, so a whole sweep costs little more than one full fit. Candidates
+# stop once the time budget is spent. Returns the best k, its centres (to warm-start the
+# final fit) and the score curve.
+def select_n_clusters(pixels, k_range=AUTO_K_RANGE, sample_size=AUTO_K_SAMPLE, budget=AUTO_K_BUDGET,
+                      seed=SAMPLING_SEED):
+    start = time.perf_counter()
+    sample = sample_pixels(pixels, sample_size, seed).astype(np.float32)
+    low, high = k_range
+    high = min(high, len(np.unique(sample, axis=0)))
+
+    scores = {}
+    best = None
+    centers = None
+    for k in range(low, high + 1):
+        if scores and time.perf_counter() - start > budget:
+            break
+        kmeans = fit_kmeans(sample, k, init_centers=centers)
+        centers = kmeans.cluster_centers_[np.argsort(-np.bincount(kmeans.labels_, minlength=k))]
+        scores[k] = silhouette_score(sample, kmeans.cluster_centers_, kmeans.labels_)
+        if best is None or scores[k] > scores[best[0]]:
+            best = (k, centers)
+
+    if best is None:
+        return min(low, len(sample)), None, {"scores": {}, "chosen": None,
+                                            "seconds": time.perf_counter() - start, "timed_out": False}
+    return best[0], best[1], {
+        "scores": scores,
+        "chosen": best[0],
+        "seconds": time.perf_counter() - start,
+        "timed_out": max(scores) < high,
+    }
+
+# Available clustering engines, selectable per call to A/B them against each other
+CLUSTER_ENGINES = {
+    "kmeans": cluster_pixels,
+    "histogram": cluster_histogram,
+    "tiled": cluster_tiled,
+    "mediancut": partial(cluster_quantize, method=Image.Quantize.MEDIANCUT),
+    "octree": partial(cluster_quantize, method=Image.Quantize.FASTOCTREE),
+}
+# libimagequant is an optional Pillow build feature
+if features.check_feature("libimagequant"):
+    CLUSTER_ENGINES["libimagequant"] = partial(cluster_quantize, method=Image.Quantize.LIBIMAGEQUANT)
+DEFAULT_ENGINE = "kmeans"
+# Engines that split the work themselves and are given every candidate pixel, not a sample
+UNSAMPLED_ENGINES = {"tiled"}
+
+# Function to parse a cluster count option: a number, or "auto" to pick it per image
+def parse_n_clusters(value):
+    return "auto" if str(value).lower() == "auto" else int(value)
+
+# Function to run the full skin tone analysis and return centers, weights and undertone.
+# n_clusters="auto" picks the cluster count per image with select_n_clusters.
+def analyze_skin_tone(image, n_clusters=3, max_pixels=DEFAULT_MAX_PIXELS, seed=SAMPLING_SEED,
+                      engine=DEFAULT_ENGINE, mask_skin=True, init_centers=None):
+    if engine not in CLUSTER_ENGINES:
+        raise ValueError(f"Unknown clustering engine: {engine}")
+
+    timings = {}
+    mark = time.perf_counter()
+
     # Convert image from PIL format to a numpy array in RGB
-    image_array = np.array(image)
+    image_array = image_to_array(image)
 
     # Reshape the image to a 2D array of pixels
     pixel_data = image_array.reshape((-1, 3))
+    timings["array"], mark = time.perf_counter() - mark, time.perf_counter()
 
-    # Apply k-means clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    kmeans.fit(pixel_data)
+    # Drop background, hair and clothing so only candidate skin pixels are clustered
+    candidates, masked = select_skin_pixels(pixel_data) if mask_skin else (pixel_data, False)
 
-    # Get the cluster centers (dominant colors)
-    dominant_colors = kmeans.cluster_centers_.astype(int)
+    # Cap how many pixels get clustered
+    sampled = candidates if engine in UNSAMPLED_ENGINES else sample_pixels(candidates, max_pixels, seed)
+    timings["mask_sample"], mark = time.perf_counter() - mark, time.perf_counter()
 
-    # Identify the dominant skin tone cluster
-    labels = kmeans.labels_
-    skin_cluster = np.argmax(np.bincount(labels))
+    # With n_clusters="auto", pick k first; its centres warm-start the fit below
+    k_selection = None
+    if n_clusters == "auto":
+        n_clusters, auto_centers, k_selection = select_n_clusters(sampled, seed=seed)
+        if init_centers is None:
+            init_centers = auto_centers
+        timings["select_k"], mark = time.perf_counter() - mark, time.perf_counter()
 
-    # Get the dominant skin tone color
+    # Cluster the pixels with the selected engine
+    convergence = {}
+    centers, counts = CLUSTER_ENGINES[engine](sampled, n_clusters, init_centers=init_centers, stats=convergence)
+    dominant_colors = centers.astype(int)
+    timings["cluster"], mark = time.perf_counter() - mark, time.perf_counter()
+
+    # Identify the dominant skin tone cluster
+    skin_cluster = np.argmax(counts)
     skin_tone_color = dominant_colors[skin_cluster]
 
-    # Classify the skin undertone
+    # Classify the skin undertone, and also vote across all clusters
     undertone = classify_undertone(skin_tone_color)
+    weights = counts / counts.sum()
+    _, votes = vote_undertone(dominant_colors, weights)
+    timings["classify"] = time.perf_counter() - mark
+
+    return {
+        "centers": centers,
+        "weights": weights,
+        "skin_tone": tuple(int(c) for c in skin_tone_color),
+        "undertone": undertone,
+        "undertone_votes": votes,
+        "engine": engine,
+        "n_pixels": len(pixel_data),
+        "n_skin": len(candidates) if masked else None,
+        "n_sampled": len(sampled),
+        "timings": timings,
+        "convergence": convergence,
+        "k_selection": k_selection,
+    }
+
+# Function to order an analysis's centres heaviest first, for warm-starting the next fit
+def warm_start_centers(analysis):
+    return analysis["centers"][np.argsort(-analysis["weights"])]
 
-    return undertone
+# Function to find the dominant skin tone from the image
+def find_dominant_skin_tone(image, n_clusters=3, max_pixels=DEFAULT_MAX_PIXELS, seed=SAMPLING_SEED,
+                            engine=DEFAULT_ENGINE, mask_skin=True):
+    return analyze_skin_tone(image, n_clusters, max_pixels, seed, engine, mask_skin)["undertone"]
+
+# Function to get the process-wide analysis cache shared by all sessions
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache(
+        max_entries=int(os.environ.get("ANALYSIS_CACHE_ENTRIES", 256)),
+        max_bytes=int(os.environ.get("ANALYSIS_CACHE_BYTES", 16 * 1024 * 1024)),
+        disk_dir=os.environ.get("ANALYSIS_CACHE_DIR") or None,
+        disk_max_bytes=int(os.environ.get("ANALYSIS_CACHE_DISK_BYTES", 256 * 1024 * 1024)),
+    )
+
+# Function to get the process-wide analysis store. Set ANALYSIS_DB to a SQLite file
+# path to keep every analysis across restarts; without it nothing is recorded.
+@st.cache_resource
+def get_analysis_store():
+    if not os.environ.get("ANALYSIS_DB"):
+        return None
+    return AnalysisStore(os.environ["ANALYSIS_DB"])
+
+# Function to import scikit-learn and run a tiny fit, so the first real request doesn't pay for it
+def warm_up_clustering():
+    cluster_pixels(np.arange(30, dtype=np.uint8).reshape((-1, 3)), n_clusters=2)
+
+# Function to start the clustering warm-up in the background, once per process.
+# With a compute pool the workers warm up themselves and the server never clusters,
+# so it is skipped; set WARM_UP_CLUSTERING=0 to skip it always.
+@st.cache_resource
+def start_warm_up():
+    if os.environ.get("WARM_UP_CLUSTERING", "1") == "0" or get_compute_pool() is not None:
+        return None
+    thread = threading.Thread(target=warm_up_clustering, name="clustering-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+# Function to get the process-wide compute pool shared by all sessions, or None
+# when COMPUTE_WORKERS=0 asks for analyses to run on the session thread
+@st.cache_resource
+def get_compute_pool():
+    workers = int(os.environ.get("COMPUTE_WORKERS", default_workers()))
+    if workers <= 0:
+        return None
+    return ComputePool(
+        workers=workers,
+        threads_per_worker=int(os.environ.get("COMPUTE_THREADS_PER_WORKER", 1)),
+        max_queued=int(os.environ.get("COMPUTE_MAX_QUEUED", 64)),
+        timeout=float(os.environ.get("COMPUTE_TIMEOUT", 120)),
+    )
+
+# Function to get the process-wide metrics registry. Set METRICS_PORT to serve it at
+# /metrics over HTTP and METRICS_FILE to also write it to a file after every request.
+@st.cache_resource
+def get_metrics():
+    registry = MetricsRegistry()
+    registry.histogram("stage_seconds", "Duration of each request stage.")
+    registry.histogram("analysis_seconds", "Time to get an analysis result, including queueing.")
+    registry.histogram("pixels", "Pixels decoded and clustered per analysis.", PIXEL_BUCKETS)
+    registry.histogram("kmeans_iterations", "k-means iterations to converge, by warm start.", ITERATION_BUCKETS)
+    registry.histogram("peak_rss_bytes", "Peak resident memory of the process during an analysis.", MEMORY_BUCKETS)
+    registry.counter("analyses_total", "Analyses served, by outcome.")
+    registry.counter("requests_total", "Get Recommendations presses, by outcome.")
+    registry.counter("uploads_rejected_total", "Uploads refused before decoding, by reason.")
+    registry.gauges("analysis_cache", "Analysis cache occupancy and counters.", get_analysis_cache().stats)
+    pool = get_compute_pool()
+    if pool is not None:
+        registry.gauges("compute_pool", "Compute pool workers, queue depth and counters.", pool.stats)
+    store = get_analysis_store()
+    if store is not None:
+        registry.gauges("analysis_store", "Analysis store rows written, dropped and queued.", store.stats)
+    if PALETTE_CATALOGUE is not None:
+        registry.gauges("palette_catalogue", "Palette catalogue size and reloads.", PALETTE_CATALOGUE.stats)
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(registry, int(os.environ["METRICS_PORT"]))
+    return registry
+
+# Function to decode and analyze image bytes
+def analyze_bytes(data, n_clusters=3, max_pixels=DEFAULT_MAX_PIXELS, seed=SAMPLING_SEED,
+                  engine=DEFAULT_ENGINE, decode_pixels=DECODE_MAX_PIXELS, mask_skin=True, init_centers=None):
+    check_upload_size(data)
+    # Peak memory of this analysis alone where the peak can be reset (Linux). Pool workers
+    # run one analysis at a time; inline, concurrent requests share the process's peak.
+    reset_peak_rss()
+    start = time.perf_counter()
+    image = load_image(data, decode_pixels)
+    decode_seconds = time.perf_counter() - start
+
+    result = analyze_skin_tone(image, n_clusters, max_pixels, seed, engine, mask_skin, init_centers)
+    result["timings"] = {"decode": decode_seconds, **result["timings"]}
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+# Function to analyze uploaded image bytes, reusing a cached result for identical uploads.
+# With a compute pool the analysis runs in a worker process; on_wait(position) reports
+# the request's place in the pool's queue while it waits. init_centers warm-starts
+# clustering from a previous fit. A warm start can settle in a different local optimum
+# than a cold fit, so a warm-started result is returned to its caller only: it is never
+# put in the shared cache or the store, where other users would get it for the same bytes.
+# With a store, results also persist across restarts, and each request is recorded
+# together with its (hair_color, eye_color) selection and palette.
+def analyze_upload(data, n_clusters=3, max_pixels=DEFAULT_MAX_PIXELS, seed=SAMPLING_SEED,
+                   engine=DEFAULT_ENGINE, cache=None, decode_pixels=DECODE_MAX_PIXELS, mask_skin=True,
+                   pool=None, on_wait=None, metrics=None, init_centers=None, store=None, selection=None):
+    check_upload_size(data)
+    options = {"n_clusters": n_clusters, "max_pixels": max_pixels, "seed": seed, "engine": engine,
+               "decode_pixels": decode_pixels, "mask_skin": mask_skin}
+    key = make_cache_key(data, **options)
+    options["init_centers"] = init_centers
+    result = cache.get(key) if cache is not None else None
+    outcome = "cache_hit"
+    if result is None and store is not None:
+        # A result stored by an earlier process (or evicted from the cache) is as good
+        result = store.get(key)
+        outcome = "store_hit"
+        if result is not None and cache is not None:
+            cache.put(key, result)
+    if result is not None:
+        if metrics is not None:
+            metrics.inc("analyses_total", outcome=outcome)
+        # The analysis is already stored; record only this request's selection and palette
+        if store is not None and selection is not None:
+            store.record(key, result, *selection, get_recommended_colors(result["undertone"], *selection),
+                         outcome=outcome)
+        return result
+
+    start = time.perf_counter()
+    if pool is not None:
+        result = pool.run(analyze_in_worker, data, options, on_wait=on_wait)
+    else:
+        result = analyze_bytes(data, **options)
+    warm_started = init_centers is not None and len(init_centers) > 0
+    if cache is not None and not warm_started:
+        cache.put(key, result)
+
+    # Stage timings are measured where the analysis ran (possibly a worker) and recorded here
+    if metrics is not None:
+        metrics.inc("analyses_total", outcome="computed")
+        metrics.observe("analysis_seconds", time.perf_counter() - start)
+        for stage, seconds in result["timings"].items():
+            metrics.observe("stage_seconds", seconds, stage=stage)
+        metrics.observe("pixels", result["n_pixels"], kind="decoded")
+        metrics.observe("pixels", result["n_sampled"], kind="clustered")
+        metrics.observe("peak_rss_bytes", result["peak_rss_bytes"])
+        if result["convergence"]:
+            metrics.observe("kmeans_iterations", result["convergence"]["n_iter"],
+                            warm_start=str(result["convergence"]["warm_start"]).lower())
+    # The store write is only queued here; a background thread does the disk I/O
+    if store is not None and selection is not None and not warm_started:
+        store.record(key, result, *selection, get_recommended_colors(result["undertone"], *selection))
+    return result
+
+# Function to pair the clusters of two analyses one-to-one (closest centres first) and
+# return how far each matched centre moved and how much its pixel share changed
+def match_clusters(reference, candidate):
+    from scipy.optimize import linear_sum_assignment
+
+    distances = np.linalg.norm(reference["centers"][:, None, :] - candidate["centers"][None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(distances)
+    return distances[rows, cols], np.abs(reference["weights"][rows] - candidate["weights"][cols])
+
+# Function to compare an engine against a reference engine on the same image and settings
+def compare_engines(image, engine, reference_engine="kmeans", n_clusters=3, max_pixels=DEFAULT_MAX_PIXELS,
+                    mask_skin=True):
+    start = time.perf_counter()
+    reference = analyze_skin_tone(image, n_clusters, max_pixels, engine=reference_engine, mask_skin=mask_skin)
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidate = analyze_skin_tone(image, n_clusters, max_pixels, engine=engine, mask_skin=mask_skin)
+    candidate_seconds = time.perf_counter() - start
+
+    centroid_shift, weight_shift = match_clusters(reference, candidate)
+    return {
+        "engine": engine,
+        "reference_engine": reference_engine,
+        "max_centroid_shift": float(centroid_shift.max()),
+        "max_weight_shift": float(weight_shift.max()),
+        "skin_tone_shift": float(np.linalg.norm(np.subtract(reference["skin_tone"], candidate["skin_tone"]))),
+        "undertone": candidate["undertone"],
+        "reference_undertone": reference["undertone"],
+        "undertone_agrees": candidate["undertone"] == reference["undertone"],
+        "seconds": candidate_seconds,
+        "reference_seconds": reference_seconds,
+    }
+
+# Function to measure how far a sampled analysis drifts from a full-resolution one
+def measure_sampling_drift(image, max_pixels=DEFAULT_MAX_PIXELS, n_clusters=3, seed=SAMPLING_SEED,
+                           engine=DEFAULT_ENGINE, mask_skin=True):
+    start = time.perf_counter()
+    full = analyze_skin_tone(image, n_clusters, max_pixels=None, engine=engine, mask_skin=mask_skin)
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sampled = analyze_skin_tone(image, n_clusters, max_pixels, seed, engine, mask_skin)
+    sampled_seconds = time.perf_counter() - start
+
+    centroid_shift, weight_shift = match_clusters(full, sampled)
+
+    return {
+        "max_pixels": max_pixels,
+        "n_pixels": full["n_pixels"],
+        "n_sampled": sampled["n_sampled"],
+        "max_centroid_shift": float(centroid_shift.max()),
+        "mean_centroid_shift": float(centroid_shift.mean()),
+        "max_weight_shift": float(weight_shift.max()),
+        "weight_error_bound": sampling_error_bound(sampled["n_sampled"]),
+        "undertone_full": full["undertone"],
+        "undertone_sampled": sampled["undertone"],
+        "undertone_agrees": full["undertone"] == sampled["undertone"],
+        "full_seconds": full_seconds,
+        "sampled_seconds": sampled_seconds,
+    }
 
 # DATASET
 dataset = [
@@ -585,57 +1283,384 @@ dataset = [
         ],
     },
 ]
+# Function to compile the dataset into an immutable palette index keyed by
+# (undertone, hair, eye), with hex codes precomputed for every colour.
+# Duplicate keys and duplicate colours inside a palette are reported as warnings;
+# the first occurrence wins, matching the old linear scan.
+def build_palette_index(entries):
+    index = {}
+    for entry in entries:
+        key = (entry["Skin Undertone"], entry["Hair Color"], entry["Eye Color"])
+        if key in index:
+            warnings.warn(f"Duplicate palette for {key}; keeping the first one")
+            continue
+
+        colors = []
+        seen_names = set()
+        seen_rgb = set()
+        for color in entry["Complementary Colors"]:
+            name = color["Color Name"]
+            rgb = tuple(color["RGB"])
+            if name in seen_names or rgb in seen_rgb:
+                warnings.warn(f"Duplicate color {name} {rgb} in palette {key}; skipping it")
+                continue
+            seen_names.add(name)
+            seen_rgb.add(rgb)
+
+            r, g, b = rgb
+            colors.append(MappingProxyType({
+                "Color Name": name,
+                "RGB": rgb,
+                "Hex": f"#{r:02X}{g:02X}{b:02X}",
+            }))
+        index[key] = tuple(colors)
+    return MappingProxyType(index)
+
+# Streamlit re-executes this script on every rerun, so build the index once per process
+@st.cache_resource
+def get_palette_index():
+    return build_palette_index(dataset)
+
+PALETTE_INDEX = get_palette_index()
+
+# Function to open the external palette catalogue, once per process. Set
+# PALETTE_CATALOGUE to a file written by catalogue.py to use it instead of the built-in
+# dataset; replacing the file is picked up within PALETTE_RELOAD_SECONDS (default 2).
+@st.cache_resource
+def get_palette_catalogue():
+    if not os.environ.get("PALETTE_CATALOGUE"):
+        return None
+    return ReloadingCatalogue(os.environ["PALETTE_CATALOGUE"],
+                              float(os.environ.get("PALETTE_RELOAD_SECONDS", 2)))
+
+PALETTE_CATALOGUE = get_palette_catalogue()
+
+# Function to get the palettes to recommend from: the external catalogue if configured
+def current_palettes():
+    return PALETTE_CATALOGUE.current() if PALETTE_CATALOGUE is not None else PALETTE_INDEX
+
 # Function to get recommended colors
 def get_recommended_colors(undertone, hair_color, eye_color):
-    for entry in dataset:
-        if (entry["Skin Undertone"] == undertone and
-            entry["Hair Color"] == hair_color and
-            entry["Eye Color"] == eye_color):
-            return entry["Complementary Colors"]
-    return []
-
-# Function to display color suggestions in a grid
-def display_colors_grid(colors):
-    num_cols = 3  # Number of columns in the grid
-    cols = st.columns(num_cols)
-
-    for i, color in enumerate(colors):
-        col = cols[i % num_cols]  # Cycle through columns
-        color_name = color["Color Name"]
-        r, g, b = color["RGB"]
-        color_hex = f"#{r:02X}{g:02X}{b:02X}"
-
-        with col:
-            st.markdown(
-                f"<div style='width:100px; height:100px; background-color:{color_hex}; border-radius:10px;'></div>",
-                unsafe_allow_html=True
-            )
-            st.write(color_name)
+    return current_palettes().get((undertone, hair_color, eye_color), ())
 
-# Streamlit app
-st.title("Color Recommendation Based on Skin Undertone, Hair, and Eye Color")
-st.write("Upload an image of your face, select your hair and eye colors, and receive color recommendations.")
+# Function to convert sRGB colours (an (N, 3) array, 0-255) to CIELAB under a D65 white point
+def rgb_to_lab(rgb):
+    srgb = np.asarray(rgb, dtype=np.float64).reshape((-1, 3)) / 255
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+
+    xyz = linear @ np.array([
+        [0.4124564, 0.2126729, 0.0193339],
+        [0.3575761, 0.7151522, 0.1191920],
+        [0.1804375, 0.0721750, 0.9503041],
+    ])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+# Perceptual search over every colour in the palette catalogue. Colours are converted
+# to CIELAB once and indexed in KD-trees, so the nearest colours by Delta E (CIE76,
+# Euclidean distance in Lab) are found without scanning the catalogue.
+class PaletteSearchIndex:
+    def __init__(self, palette_index):
+        # One row per distinct colour, remembering which hair/eye palettes it appears in
+        rows = {}
+        for (undertone, hair_color, eye_color), colors in palette_index.items():
+            for color in colors:
+                row = rows.setdefault((color["Color Name"], color["RGB"]), {"color": color, "owners": set()})
+                row["owners"].add((hair_color, eye_color))
+
+        self.colors = [row["color"] for row in rows.values()]
+        self.owners = [row["owners"] for row in rows.values()]
+        self.lab = rgb_to_lab([color["RGB"] for color in self.colors])
+        self._subsets = {}
+        self._lock = threading.Lock()
+
+    # Function to get the rows and KD-tree for the colours of matching hair/eye palettes
+    def _subset(self, hair_color, eye_color):
+        key = (hair_color, eye_color)
+        with self._lock:
+            if key not in self._subsets:
+                from scipy.spatial import cKDTree
 
-uploaded_image = st.file_uploader("Upload Image", type=["jpg", "png", "jpeg"])
-hair_color = st.selectbox("Select Hair Color", ["Black", "Brown", "Blonde"])
-eye_color = st.selectbox("Select Eye Color", ["Black", "Brown", "Blue", "Gray"])
+                rows = np.array([
+                    i for i, owners in enumerate(self.owners)
+                    if any((hair_color is None or hair == hair_color) and (eye_color is None or eye == eye_color)
+                           for hair, eye in owners)
+                ], dtype=np.intp)
+                tree = cKDTree(self.lab[rows]) if len(rows) else None
+                self._subsets[key] = (rows, tree)
+            return self._subsets[key]
 
-# Submit button
-if st.button("Get Recommendations"):
-    if uploaded_image:
-        image = Image.open(uploaded_image)
-        st.image(image, caption="Uploaded Image", use_container_width=True)
+    # Function to find the k catalogue colours closest to (or, with contrast=True,
+    # furthest from) the given skin colour, optionally limited to a hair/eye palette set
+    def query(self, skin_rgb, hair_color=None, eye_color=None, k=8, contrast=False):
+        rows, tree = self._subset(hair_color, eye_color)
+        if tree is None:
+            return []
+        k = min(k, len(rows))
+        target = rgb_to_lab(skin_rgb)[0]
 
-        undertone = find_dominant_skin_tone(image)  # Ensure this function is defined
+        if contrast:
+            # Furthest-neighbour queries don't suit a KD-tree; a vectorized Delta E pass does
+            distances = np.linalg.norm(self.lab[rows] - target, axis=1)
+            order = np.argpartition(-distances, k - 1)[:k]
+            order = order[np.argsort(-distances[order])]
+            matches = zip(distances[order], order)
+        else:
+            distances, order = tree.query(target, k=k)
+            matches = zip(np.atleast_1d(distances), np.atleast_1d(order))
+
+        return [{**self.colors[rows[i]], "Delta E": round(float(distance), 2)} for distance, i in matches]
+
+# Function to build the perceptual search index for one version of the palettes. Only
+# the current and the previous catalogue versions are kept.
+@st.cache_resource(max_entries=2)
+def build_palette_search_index(_palettes, version):
+    return PaletteSearchIndex(_palettes)
+
+# Function to get the perceptual search index of the current palettes
+def get_palette_search_index():
+    palettes = current_palettes()
+    return build_palette_search_index(palettes, getattr(palettes, "version", None))
+
+# Function to get the catalogue colours perceptually closest to (or contrasting most with) a skin colour
+def find_nearest_colors(skin_rgb, hair_color=None, eye_color=None, k=8, contrast=False):
+    return get_palette_search_index().query(skin_rgb, hair_color, eye_color, k, contrast)
+
+# Function to turn a palette into a hashable key for the render cache
+def palette_key(colors):
+    return tuple((color["Color Name"], color["Hex"], tuple(color["RGB"])) for color in colors)
+
+# Function to encode a palette as an Adobe Swatch Exchange (.ase) file
+def palette_to_ase(palette):
+    blocks = []
+    for name, _, rgb in palette:
+        encoded_name = (name + "\0").encode("utf-16-be")
+        body = (struct.pack(">H", len(name) + 1) + encoded_name + b"RGB " +
+                struct.pack(">3f", *(channel / 255 for channel in rgb)) + struct.pack(">H", 2))
+        blocks.append(struct.pack(">HI", 0x0001, len(body)) + body)
+    return b"ASEF" + struct.pack(">HHI", 1, 0, len(blocks)) + b"".join(blocks)
+
+# Function to draw a palette as a PNG swatch sheet
+def palette_to_png(palette, num_cols=3, swatch=100, gap=20):
+    from PIL import ImageDraw
+
+    num_rows = max(1, -(-len(palette) // num_cols))
+    cell_w, cell_h = swatch + gap, swatch + gap + 16
+    sheet = Image.new("RGB", (num_cols * cell_w + gap, num_rows * cell_h + gap), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (name, color_hex, _) in enumerate(palette):
+        x = gap + (i % num_cols) * cell_w
+        y = gap + (i // num_cols) * cell_h
+        draw.rounded_rectangle([x, y, x + swatch, y + swatch], radius=10, fill=color_hex)
+        draw.text((x, y + swatch + 4), name, fill="black")
+    buf = io.BytesIO()
+    sheet.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+# Function to build every rendering of a palette once: the HTML grid shown in the app
+# and the JSON, PNG and ASE downloads. Cached across reruns and sessions per palette.
+@st.cache_data(max_entries=512, show_spinner=False)
+def build_palette_artifacts(palette, num_cols=3):
+    cells = "".join(
+        f"<div style='text-align:left'>"
+        f"<div style='width:100px; height:100px; background-color:{color_hex}; border-radius:10px;'></div>"
+        f"<p style='margin:0.5rem 0 1rem 0'>{html.escape(name)}</p></div>"
+        for name, color_hex, _ in palette
+    )
+    grid_html = f"<div style='display:grid; grid-template-columns:repeat({num_cols}, 1fr); gap:0 1rem;'>{cells}</div>"
+    palette_json = json.dumps(
+        [{"name": name, "hex": color_hex, "rgb": list(rgb)} for name, color_hex, rgb in palette], indent=2
+    )
+    return {
+        "html": grid_html,
+        "json": palette_json.encode(),
+        "png": palette_to_png(palette, num_cols),
+        "ase": palette_to_ase(palette),
+    }
+
+# Function to display color suggestions in a grid, sent to the browser as a single element.
+# With download_key set, also offer the palette as JSON, PNG and ASE downloads.
+def display_colors_grid(colors, download_key=None):
+    artifacts = build_palette_artifacts(palette_key(colors))
+    st.markdown(artifacts["html"], unsafe_allow_html=True)
+
+    if download_key:
+        for col, (fmt, mime) in zip(st.columns(3), [("json", "application/json"), ("png", "image/png"),
+                                                    ("ase", "application/octet-stream")]):
+            with col:
+                st.download_button(f"Download {fmt.upper()}", artifacts[fmt], file_name=f"palette.{fmt}",
+                                   mime=mime, key=f"{download_key}-{fmt}")
+
+# Function to show the undertone and palettes for an analysis and the selected hair/eye colours
+def show_recommendations(analysis, hair_color, eye_color, metrics, timings):
+    undertone = analysis["undertone"]
+    with metrics.time_stage("lookup", timings):
         recommended_colors = get_recommended_colors(undertone, hair_color, eye_color)
 
-        if recommended_colors:
-            st.write(f"**Skin Undertone:** {undertone}")
-            st.write(f"**Hair Color:** {hair_color}")
-            st.write(f"**Eye Color:** {eye_color}")
+    if recommended_colors:
+        metrics.inc("requests_total", outcome="ok")
+        st.write(f"**Skin Undertone:** {undertone}")
+        st.write(f"**Hair Color:** {hair_color}")
+        st.write(f"**Eye Color:** {eye_color}")
+        with metrics.time_stage("render", timings):
             st.write("### Recommended Colors:")
-            display_colors_grid(recommended_colors)
-        else:
-            st.warning("No matching colors found in the dataset.")
+            display_colors_grid(recommended_colors, download_key="recommended")
+            st.write("### Closest Shades to Your Skin Tone:")
+            display_colors_grid(find_nearest_colors(analysis["skin_tone"], hair_color, eye_color, k=6))
     else:
-        st.error("Please upload an image first.")
+        metrics.inc("requests_total", outcome="no_palette")
+        st.warning("No matching colors found in the dataset.")
+
+# Function to run the live camera mode: every new camera frame updates a streaming
+# tracker kept in the session, and recommendations follow the smoothed undertone
+def run_camera_mode(hair_color, eye_color, n_clusters, metrics):
+    from stream import FRAME_MAX_PIXELS, StreamingSkinTone
+
+    frame = st.camera_input("Camera")
+    tracker = st.session_state.get("camera_tracker")
+    if tracker is None or tracker.n_clusters != n_clusters:
+        tracker = st.session_state["camera_tracker"] = StreamingSkinTone(n_clusters)
+
+    if frame is not None and frame.file_id != st.session_state.get("camera_frame_id"):
+        st.session_state["camera_frame_id"] = frame.file_id
+        with metrics.time_stage("camera_frame"):
+            tracker.update(load_image(frame.getvalue(), FRAME_MAX_PIXELS))
+
+    result = tracker.result()
+    if result is None:
+        st.info("Take a few pictures under different lighting to track your undertone.")
+        return
+    st.caption(f"Undertone smoothed over the last {len(tracker.window)} of {tracker.frames} frames.")
+    show_recommendations(result, hair_color, eye_color, metrics, {})
+
+# Options offered for hair and eye colour selection
+HAIR_COLORS = ["Black", "Brown", "Blonde"]
+EYE_COLORS = ["Black", "Brown", "Blue", "Gray"]
+
+# Streamlit app
+def run_app():
+    st.title("Color Recommendation Based on Skin Undertone, Hair, and Eye Color")
+    st.write("Upload an image of your face, select your hair and eye colors, and receive color recommendations.")
+
+    input_mode = st.sidebar.radio("Input", ["Photo upload", "Live camera"])
+    uploaded_image = None
+    if input_mode == "Photo upload":
+        uploaded_image = st.file_uploader("Upload Image", type=["jpg", "png", "jpeg"])
+    hair_color = st.selectbox("Select Hair Color", HAIR_COLORS)
+    eye_color = st.selectbox("Select Eye Color", EYE_COLORS)
+
+    auto_clusters = st.sidebar.checkbox("Pick the number of clusters automatically")
+    n_clusters = st.sidebar.slider("Number of color clusters", 2, 8, 3, disabled=auto_clusters)
+
+    metrics = get_metrics()
+    timings = {}
+
+    if input_mode == "Live camera":
+        run_camera_mode(hair_color, eye_color, n_clusters, metrics)
+        return
+
+    # The camera tracker needs a fixed cluster count; photo analysis can pick its own
+    if auto_clusters:
+        n_clusters = "auto"
+
+    # Submit button
+    if st.button("Get Recommendations"):
+        if uploaded_image:
+            with metrics.time_stage("upload_read", timings):
+                data = uploaded_image.getvalue()
+
+            # Warm-start from this session's previous fit of the same upload (e.g. after
+            # changing the cluster count); another image's centres would bias the fit
+            previous = st.session_state.get("analysis")
+            same_upload = previous is not None and previous["file_id"] == uploaded_image.file_id
+            init_centers = warm_start_centers(previous["result"]) if same_upload else None
+
+            # Show the request's place in the shared compute queue while it waits
+            status = st.empty()
+            try:
+                analysis = analyze_upload(
+                    data,
+                    n_clusters=n_clusters,
+                    cache=get_analysis_cache(),
+                    pool=get_compute_pool(),
+                    on_wait=lambda position: status.info(f"Queued: position {position}. Analyzing shortly..."),
+                    metrics=metrics,
+                    init_centers=init_centers,
+                    store=get_analysis_store(),
+                    selection=(hair_color, eye_color),
+                )
+            except PoolBusyError:
+                metrics.inc("requests_total", outcome="busy")
+                status.empty()
+                st.error("The server is busy right now. Please try again in a moment.")
+                return
+            except BrokenExecutor:
+                # The pool has already been replaced; the next attempt gets a fresh worker
+                metrics.inc("requests_total", outcome="worker_failed")
+                status.empty()
+                st.error("The analysis failed on the server. Please try again in a moment.")
+                return
+            except FutureTimeoutError:
+                metrics.inc("requests_total", outcome="timeout")
+                status.empty()
+                st.error("The analysis took too long. Please try again with a smaller image.")
+                return
+            except UploadRejected as exc:
+                metrics.inc("requests_total", outcome="rejected")
+                metrics.inc("uploads_rejected_total", reason=exc.reason)
+                status.empty()
+                st.error(f"This image can't be analyzed. {exc}")
+                return
+            status.empty()
+            # Shown only once the upload passed the size checks, since st.image decodes it
+            st.image(uploaded_image, caption="Uploaded Image", use_container_width=True)
+            st.session_state["analysis"] = {
+                "file_id": uploaded_image.file_id,
+                "n_clusters": n_clusters,
+                "result": analysis,
+            }
+            timings.update(analysis["timings"])
+            show_recommendations(analysis, hair_color, eye_color, metrics, timings)
+        else:
+            st.error("Please upload an image first.")
+
+        if os.environ.get("METRICS_FILE"):
+            metrics.write_file(os.environ["METRICS_FILE"])
+
+    # Changing only hair or eye colour reruns the script without the button; reuse the
+    # session's analysis of the same upload instead of clustering again
+    elif uploaded_image:
+        previous = st.session_state.get("analysis")
+        if previous and previous["file_id"] == uploaded_image.file_id and previous["n_clusters"] == n_clusters:
+            st.image(uploaded_image, caption="Uploaded Image", use_container_width=True)
+            metrics.inc("analyses_total", outcome="session_reuse")
+            show_recommendations(previous["result"], hair_color, eye_color, metrics, timings)
+
+    # Optional debug panel, enabled with ?debug=1 or DEBUG_PANEL=1
+    if st.query_params.get("debug") == "1" or os.environ.get("DEBUG_PANEL") == "1":
+        with st.expander("Debug metrics"):
+            if timings:
+                st.write("**This request (ms):**")
+                st.json({stage: round(seconds * 1000, 2) for stage, seconds in timings.items()})
+            previous = st.session_state.get("analysis")
+            if previous and previous["result"].get("peak_rss_bytes"):
+                st.write(f"**Peak memory of the analysis:** {previous['result']['peak_rss_bytes'] / 1e6:.0f} MB")
+            if previous and previous["result"]["convergence"]:
+                st.write("**Clustering convergence:**")
+                st.json(previous["result"]["convergence"])
+            if previous and previous["result"].get("k_selection"):
+                st.write("**Cluster count selection (silhouette by k):**")
+                st.json(previous["result"]["k_selection"])
+            st.code(metrics.render(), language="text")
+
+    # Preload the clustering engine now that the page has been painted
+    start_warm_up()
+
+
+# Streamlit runs this script as __main__; importing it (batch jobs, workers) only loads the functions
+if __name__ == "__main__":
+    # Let sibling modules (e.g. stream) `import main` without executing this script a second time
+    sys.modules["main"] = sys.modules[__name__]
+    run_app()
@@ -0,0 +1,161 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PIXEL_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 2.5e7, 5e7, 1e8)
+ITERATION_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 300)
+MEMORY_BUCKETS = (5e7, 1e8, 2e8, 3e8, 5e8, 7.5e8, 1e9, 1.5e9, 2e9, 4e9, 8e9)
+
+
+# Function to format label pairs the way Prometheus expects, e.g. {stage="decode"}
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in sorted(labels.items())) + "}"
+
+
+# Cumulative-bucket histogram, one series per label set
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+
+# Monotonic counter, one series per label set
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(dict(key))} {value}")
+        return lines
+
+
+# Registry of histograms and counters, plus gauges read from callbacks at render time.
+# Recording takes one lock and a few dict operations, so it is cheap enough to leave on.
+class MetricsRegistry:
+    def __init__(self, prefix="colour_app"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._gauges = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            full_name = f"{self.prefix}_{name}"
+            if full_name not in self._metrics:
+                self._metrics[full_name] = Histogram(full_name, help_text, buckets)
+            return self._metrics[full_name]
+
+    def counter(self, name, help_text):
+        with self._lock:
+            full_name = f"{self.prefix}_{name}"
+            if full_name not in self._metrics:
+                self._metrics[full_name] = Counter(full_name, help_text)
+            return self._metrics[full_name]
+
+    # Function to register a callback returning a dict of gauge values, e.g. cache.stats
+    def gauges(self, name, help_text, callback):
+        with self._lock:
+            self._gauges[f"{self.prefix}_{name}"] = (help_text, callback)
+
+    def observe(self, name, value, **labels):
+        metric = self._metrics[f"{self.prefix}_{name}"]
+        with self._lock:
+            metric.observe(value, **labels)
+
+    def inc(self, name, amount=1, **labels):
+        metric = self._metrics[f"{self.prefix}_{name}"]
+        with self._lock:
+            metric.inc(amount, **labels)
+
+    # Function to time a block and record it in the stage latency histogram
+    @contextmanager
+    def time_stage(self, stage, timings=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_seconds", elapsed, stage=stage)
+            if timings is not None:
+                timings[stage] = elapsed
+
+    # Function to render every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.extend(metric.render())
+            gauges = list(self._gauges.items())
+        for name, (help_text, callback) in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(callback().items()):
+                lines.append(f'{name}{format_labels({"field": key})} {value}')
+        return "\n".join(lines) + "\n"
+
+    # Function to write the metrics to a file for a node-exporter style textfile collector
+    def write_file(self, path):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+# Function to serve the registry at http://host:port/metrics from a daemon thread
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,276 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import main
+from cache import AnalysisCache, make_cache_key
+from compute import analyze_in_worker, default_workers, init_worker
+from metrics import MetricsRegistry
+
+
+# Collects concurrent analysis requests into short micro-batches. A batch closes after
+# max_batch requests or max_wait seconds, whichever comes first. Identical uploads in a
+# batch (or already in the cache) are analyzed once, and each distinct image is fanned
+# out to a shared process pool, so one dispatch serves the whole batch. A worker that
+# dies (e.g. killed for memory) breaks a ProcessPoolExecutor for good, so the pool is
+# then replaced: the jobs that were running fail, later batches run on the new pool.
+class MicroBatcher:
+    def __init__(self, workers=None, max_batch=16, max_wait=0.005, cache=None):
+        self.workers = workers or default_workers()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.deduplicated = 0
+        self.restarts = 0
+        threading.Thread(target=self._loop, name="micro-batcher", daemon=True).start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    # Function to replace a broken executor; only the first caller for it starts a new one
+    def _restart(self, broken):
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+            self.restarts += 1
+        broken.shutdown(wait=False)
+
+    # Function to submit one analysis, moving to a new pool if the current one is broken
+    def _submit(self, data, options):
+        executor = self._executor
+        try:
+            return executor, executor.submit(analyze_in_worker, data, options)
+        except BrokenExecutor:
+            self._restart(executor)
+            executor = self._executor
+            return executor, executor.submit(analyze_in_worker, data, options)
+
+    # Function to queue one request; returns a Future resolving to the analysis
+    def submit(self, data, options):
+        future = Future()
+        self._queue.put((make_cache_key(data, **options), data, options, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        self.batches += 1
+        self.requests += len(batch)
+
+        waiting = {}
+        for key, data, options, future in batch:
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                future.set_result(cached)
+            elif key in waiting:
+                waiting[key][2].append(future)
+                self.deduplicated += 1
+            else:
+                waiting[key] = (data, options, [future])
+
+        for key, (data, options, futures) in waiting.items():
+            try:
+                executor, job = self._submit(data, options)
+            except BrokenExecutor as exc:
+                # Even the new pool failed; fail these requests, not the batcher thread
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+            job.add_done_callback(
+                lambda job, executor=executor, key=key, futures=futures: self._resolve(executor, key, job, futures)
+            )
+
+    def _resolve(self, executor, key, job, futures):
+        error = job.exception()
+        if isinstance(error, BrokenExecutor):
+            self._restart(executor)
+        if error is None and self.cache is not None:
+            self.cache.put(key, job.result())
+        for future in futures:
+            if error is None:
+                future.set_result(job.result())
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "deduplicated": self.deduplicated,
+            "restarts": self.restarts,
+            "queued": self._queue.qsize(),
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+# Function to turn an analysis and hair/eye selection into the JSON response body
+def build_response(analysis, hair_color, eye_color):
+    palette = main.get_recommended_colors(analysis["undertone"], hair_color, eye_color)
+    return {
+        "undertone": analysis["undertone"],
+        "undertone_votes": analysis["undertone_votes"],
+        "skin_tone": list(analysis["skin_tone"]),
+        "centers": np.asarray(analysis["centers"], dtype=np.float64).round(2).tolist(),
+        "weights": np.asarray(analysis["weights"], dtype=np.float64).round(6).tolist(),
+        "k_selection": analysis.get("k_selection"),
+        "hair_color": hair_color,
+        "eye_color": eye_color,
+        "palette": [{"name": color["Color Name"], "rgb": list(color["RGB"]), "hex": color["Hex"]}
+                    for color in palette],
+        "timings": analysis["timings"],
+    }
+
+
+# Function to build the service's metrics: upload refusals by reason, counted like the
+# app's, and the batcher's statistics
+def make_metrics(batcher):
+    registry = MetricsRegistry(prefix="colour_service")
+    registry.counter("uploads_rejected_total", "Uploads refused before decoding, by reason.")
+    registry.gauges("micro_batcher", "Micro-batches, requests, deduplicated requests, pool restarts and queue depth.",
+                    batcher.stats)
+    return registry
+
+
+# Function to build the HTTP handler class bound to a batcher
+def make_handler(batcher, timeout=30, metrics=None):
+    metrics = metrics or make_metrics(batcher)
+
+    class AnalysisHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps connections alive between requests
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_rejection(self, exc):
+            metrics.inc("uploads_rejected_total", reason=exc.reason)
+            self.send_json(413, {"error": exc.message, "reason": exc.reason})
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self.send_json(200, {"status": "ok", **batcher.stats()})
+            elif path == "/metrics":
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        # POST /analyze?hair=Black&eye=Brown&n_clusters=3 (or auto) with the raw image bytes as the body
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            if not 0 <= length <= main.UPLOAD_MAX_BYTES:
+                # Refuse from the header alone; the unread body means the connection can't be reused
+                self.close_connection = True
+                if url.path != "/analyze":
+                    self.send_json(404, {"error": "not found"})
+                elif length < 0:
+                    self.send_json(400, {"error": "invalid Content-Length"})
+                else:
+                    try:
+                        main.check_upload_size(length)
+                    except main.UploadRejected as exc:
+                        self.send_rejection(exc)
+                return
+            data = self.rfile.read(length)
+            if url.path != "/analyze":
+                self.send_json(404, {"error": "not found"})
+                return
+            if not data:
+                self.send_json(400, {"error": "the body must be the image bytes"})
+                return
+
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            hair_color = params.get("hair", main.HAIR_COLORS[0])
+            eye_color = params.get("eye", main.EYE_COLORS[0])
+            try:
+                options = {
+                    "n_clusters": main.parse_n_clusters(params.get("n_clusters", 3)),
+                    "max_pixels": main.DEFAULT_MAX_PIXELS,
+                    "seed": main.SAMPLING_SEED,
+                    "engine": params.get("engine", main.DEFAULT_ENGINE),
+                    "decode_pixels": main.DECODE_MAX_PIXELS,
+                    "mask_skin": params.get("mask_skin", "1") != "0",
+                }
+                analysis = batcher.submit(data, options).result(timeout=timeout)
+            except main.UploadRejected as exc:
+                self.send_rejection(exc)
+                return
+            except FutureTimeoutError:
+                self.send_json(504, {"error": f"the analysis took longer than {timeout} s"})
+                return
+            except BrokenExecutor as exc:
+                self.send_json(503, {"error": f"the worker pool is unavailable: {type(exc).__name__}: {exc}"})
+                return
+            except Exception as exc:
+                self.send_json(422, {"error": f"{type(exc).__name__}: {exc}"})
+                return
+            self.send_json(200, build_response(analysis, hair_color, eye_color))
+
+        def log_message(self, format, *args):
+            pass
+
+    return AnalysisHandler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve skin undertone analysis over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Worker processes (default: usable CPUs, at most 4)")
+    parser.add_argument("--max-batch", type=int, default=16, help="Requests per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="How long a batch waits to fill")
+    parser.add_argument("--cache-entries", type=int, default=1024)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    batcher = MicroBatcher(args.workers, args.max_batch, args.max_wait_ms / 1000,
+                           cache=AnalysisCache(max_entries=args.cache_entries))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print(f"Serving on http://{args.host}:{args.port} (POST /analyze, GET /health)")
+    server.serve_forever()
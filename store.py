@@ -0,0 +1,265 @@
+import argparse
+import atexit
+import csv
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+COLUMNS = (
+    "id", "created_at", "image_hash", "cache_key", "engine", "n_clusters", "hair_color", "eye_color",
+    "undertone", "skin_tone", "undertone_votes", "centers", "weights", "palette", "timings",
+    "n_pixels", "n_skin", "n_sampled", "convergence", "k_selection", "peak_rss_bytes", "outcome",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    image_hash TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    engine TEXT,
+    n_clusters INTEGER,
+    hair_color TEXT,
+    eye_color TEXT,
+    undertone TEXT,
+    skin_tone TEXT,
+    undertone_votes TEXT,
+    centers TEXT,
+    weights TEXT,
+    palette TEXT,
+    timings TEXT,
+    n_pixels INTEGER,
+    n_skin INTEGER,
+    n_sampled INTEGER,
+    convergence TEXT,
+    k_selection TEXT,
+    peak_rss_bytes INTEGER,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_image_hash ON analyses (image_hash);
+CREATE INDEX IF NOT EXISTS analyses_cache_key ON analyses (cache_key);
+"""
+
+# Columns added after the first release, added to older databases when they are opened
+ADDED_COLUMNS = (("k_selection", "TEXT"), ("peak_rss_bytes", "INTEGER"), ("outcome", "TEXT"))
+
+
+# Function to encode a value as JSON, turning numpy arrays and scalars into plain lists and numbers
+def to_json(value):
+    return json.dumps(value, default=lambda item: item.item() if isinstance(item, np.generic) else item.tolist())
+
+
+# Function to open a connection in WAL mode, so readers never block the writer or each other
+def connect(path, check_same_thread=True):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+# Persistent record of every analysis in a SQLite database. record() only queues the
+# row; a background thread writes queued rows in batches of up to batch_size, at least
+# every flush_interval seconds, so the request path never waits on disk. When the
+# queue is full, rows are dropped and counted rather than blocking the request.
+# A computed analysis is stored in full once; a request served from the cache or the
+# store adds a row with its outcome, selection and palette only.
+class AnalysisStore:
+    def __init__(self, path, batch_size=64, flush_interval=1.0, max_queued=10_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.written = 0
+        self.dropped = 0
+        with closing(connect(path)) as connection, connection:
+            connection.executescript(SCHEMA)
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(analyses)")}
+            for name, column_type in ADDED_COLUMNS:
+                if name not in existing:
+                    connection.execute(f"ALTER TABLE analyses ADD COLUMN {name} {column_type}")
+        # get() runs on the request path, so lookups share one open read connection
+        # instead of connecting (and setting the PRAGMAs) on every cache miss
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="analysis-store", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # Function to queue one analysis with the selection and palette it was shown with.
+    # outcome is "computed" for a new analysis, or "cache_hit" / "store_hit" for a reused
+    # one, which is recorded without repeating the analysis itself.
+    def record(self, cache_key, analysis, hair_color=None, eye_color=None, palette=(), outcome="computed"):
+        computed = outcome == "computed"
+
+        def field(name, encode=to_json):
+            value = analysis.get(name)
+            return encode(value) if computed and value is not None else None
+
+        row = (
+            time.time(), cache_key.split("|", 1)[0], cache_key, analysis["engine"], len(analysis["centers"]),
+            hair_color, eye_color, analysis["undertone"], field("skin_tone"), field("undertone_votes"),
+            field("centers"), field("weights"),
+            to_json([{"name": color["Color Name"], "hex": color["Hex"]} for color in palette]),
+            field("timings"), field("n_pixels", int), field("n_skin", int), field("n_sampled", int),
+            field("convergence"), field("k_selection"), field("peak_rss_bytes", int), outcome,
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        connection = connect(self.path)
+        insert = f"INSERT INTO analyses ({', '.join(COLUMNS[1:])}) VALUES ({', '.join('?' * (len(COLUMNS) - 1))})"
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with connection:
+                    connection.executemany(insert, batch)
+                self.written += len(batch)
+            except sqlite3.Error as exc:
+                self.dropped += len(batch)
+                print(f"analysis store: dropped {len(batch)} rows: {exc}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # Function to wait until every queued row has been written
+    def flush(self):
+        self._queue.join()
+
+    # Function to write the queued rows and close the read connection
+    def close(self):
+        self.flush()
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    # Function to run a read query on the shared read connection, opened on first use
+    def _read(self, query, params):
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = connect(self.path, check_same_thread=False)
+                self._reader.row_factory = sqlite3.Row
+            return self._reader.execute(query, params).fetchall()
+
+    # Function to get the stored analyses of an image, newest first (indexed by image hash)
+    def lookup(self, image_hash, limit=20):
+        rows = self._read("SELECT * FROM analyses WHERE image_hash = ? ORDER BY id DESC LIMIT ?", (image_hash, limit))
+        return [dict(row) for row in rows]
+
+    # Function to rebuild the most recent analysis stored under a cache key, or None.
+    # Rows of reused results don't hold the analysis, so only full rows are read.
+    def get(self, cache_key):
+        rows = self._read(
+            "SELECT * FROM analyses WHERE cache_key = ? AND centers IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (cache_key,),
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "centers": np.array(json.loads(row["centers"])),
+            "weights": np.array(json.loads(row["weights"])),
+            "skin_tone": tuple(json.loads(row["skin_tone"])),
+            "undertone": row["undertone"],
+            "undertone_votes": json.loads(row["undertone_votes"]),
+            "engine": row["engine"],
+            "n_pixels": row["n_pixels"],
+            "n_skin": row["n_skin"],
+            "n_sampled": row["n_sampled"],
+            "timings": json.loads(row["timings"]),
+            "convergence": json.loads(row["convergence"]),
+            "k_selection": json.loads(row["k_selection"]) if row["k_selection"] else None,
+            "peak_rss_bytes": row["peak_rss_bytes"],
+        }
+
+    # Function to stream every row (or those after since_id) in chunks, without loading the table
+    def iter_rows(self, since_id=0, chunk_size=1000):
+        with closing(connect(self.path)) as connection:
+            cursor = connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM analyses WHERE id > ? ORDER BY id", (since_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    # Function to export rows to CSV; JSON columns are written as JSON text
+    def export_csv(self, path, since_id=0, chunk_size=1000):
+        count = 0
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for rows in self.iter_rows(since_id, chunk_size):
+                writer.writerows(rows)
+                count += len(rows)
+        return count
+
+    # Function to export rows to a Parquet file, one row group per chunk. Needs pyarrow,
+    # which Streamlit already depends on.
+    def export_parquet(self, path, since_id=0, chunk_size=10_000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from None
+
+        integer_columns = {"id", "n_clusters", "n_pixels", "n_skin", "n_sampled", "peak_rss_bytes"}
+        schema = pa.schema([
+            (name, pa.int64() if name in integer_columns else pa.float64() if name == "created_at" else pa.string())
+            for name in COLUMNS
+        ])
+        count = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            for rows in self.iter_rows(since_id, chunk_size):
+                writer.write_table(pa.Table.from_arrays([pa.array(column) for column in zip(*rows)], schema=schema))
+                count += len(rows)
+        return count
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query or export the analysis store.")
+    parser.add_argument("database", help="SQLite database written by the app (ANALYSIS_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Export rows to .csv or .parquet")
+    export.add_argument("output")
+    export.add_argument("--since-id", type=int, default=0, help="Only rows with a larger id")
+    lookup = commands.add_parser("lookup", help="Print the stored analyses of an image hash")
+    lookup.add_argument("image_hash")
+    lookup.add_argument("--limit", type=int, default=20)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = AnalysisStore(args.database)
+    if args.command == "export":
+        if args.output.endswith(".parquet"):
+            count = store.export_parquet(args.output, args.since_id)
+        else:
+            count = store.export_csv(args.output, args.since_id)
+        print(f"Exported {count} rows to {args.output}", file=sys.stderr)
+    else:
+        for row in store.lookup(args.image_hash, args.limit):
+            print(json.dumps(row))
@@ -0,0 +1,158 @@
+import argparse
+import json
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import main
+
+FRAME_MAX_PIXELS = 160_000
+FRAME_SAMPLE_PIXELS = 4_000
+
+
+# Function to yield RGB frames from a video file. Animated GIF/WebP/APNG are read with
+# Pillow; other formats need OpenCV (opencv-python-headless), which is optional.
+def iter_video_frames(path):
+    # Only opening the file decides between Pillow and OpenCV; a frame that fails to
+    # decode later raises instead of falling through and re-reading from frame 0
+    try:
+        image = Image.open(path)
+        animated = getattr(image, "is_animated", False)
+    except OSError:
+        image, animated = None, False
+    if animated:
+        with image:
+            for frame in ImageSequence.Iterator(image):
+                yield main.image_to_array(frame)
+        return
+    if image is not None:
+        image.close()
+
+    try:
+        import cv2
+    except ImportError:
+        raise RuntimeError("Reading video files needs OpenCV: pip install opencv-python-headless") from None
+
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+
+
+# Function to pace frames to a target rate. Frames that arrive sooner than 1/target_fps
+# after the last kept frame are dropped, so a fast source or a slow consumer lowers the
+# analyzed frame rate instead of building a backlog.
+def throttle(frames, target_fps, source_fps=None):
+    interval = 1 / target_fps
+    if source_fps:
+        # A file has its own clock: keep every n-th frame to match the target rate
+        step = max(1, round(source_fps / target_fps))
+        for i, frame in enumerate(frames):
+            if i % step == 0:
+                yield frame
+        return
+
+    next_time = 0.0
+    for frame in frames:
+        now = time.perf_counter()
+        if now < next_time:
+            continue
+        next_time = now + interval
+        yield frame
+
+
+# Function to downsample a frame to a pixel budget by integer striding (no copy until sampling)
+def downsample_frame(frame, max_pixels=FRAME_MAX_PIXELS):
+    height, width = frame.shape[:2]
+    step = int(np.ceil(np.sqrt(height * width / max_pixels))) if height * width > max_pixels else 1
+    return frame[::step, ::step]
+
+
+# Incremental skin tone tracker for a stream of frames. Each frame's sampled skin
+# pixels update a mini-batch k-means model, and the undertone is smoothed by a
+# weighted vote over a sliding window of recent frames. Memory is fixed by the
+# window length and sample size, however long the stream runs.
+class StreamingSkinTone:
+    def __init__(self, n_clusters=3, window=15, sample_pixels=FRAME_SAMPLE_PIXELS, seed=main.SAMPLING_SEED):
+        from sklearn.cluster import MiniBatchKMeans
+
+        self.n_clusters = n_clusters
+        self.sample_pixels = sample_pixels
+        self.seed = seed
+        self.model = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, batch_size=sample_pixels, n_init=1)
+        self.window = deque(maxlen=window)
+        self.frames = 0
+        self._fitted = False
+
+    # Function to update the model with one frame and return the current smoothed result
+    def update(self, frame):
+        pixel_data = downsample_frame(main.image_to_array(frame)).reshape((-1, 3))
+        candidates, _ = main.select_skin_pixels(pixel_data)
+        sampled = main.sample_pixels(candidates, self.sample_pixels, self.seed + self.frames)
+        self.frames += 1
+        if len(sampled) < self.n_clusters:
+            return self.result()
+
+        sampled = sampled.astype(np.float32)
+        self.model.partial_fit(sampled)
+        self._fitted = True
+
+        # Dominant cluster of this frame, judged by the current shared centres
+        counts = np.bincount(self.model.predict(sampled), minlength=self.n_clusters)
+        skin_tone = self.model.cluster_centers_[np.argmax(counts)].astype(int)
+        self.window.append((main.classify_undertone(skin_tone), counts.max() / counts.sum(), skin_tone))
+        return self.result()
+
+    # Function to vote on the undertone over the window, each frame weighted by its dominant share
+    def result(self):
+        if not self.window:
+            return None
+        votes = {undertone: 0.0 for undertone in main.UNDERTONES}
+        for undertone, share, _ in self.window:
+            votes[undertone] += share
+        total = sum(votes.values())
+        skin_tone = np.mean([tone for _, _, tone in self.window], axis=0).astype(int)
+        centers = np.asarray(self.model.cluster_centers_, dtype=np.float64) if self._fitted else np.empty((0, 3))
+        return {
+            "undertone": max(votes, key=votes.get),
+            "frame_undertone": self.window[-1][0],
+            "undertone_votes": {undertone: vote / total for undertone, vote in votes.items()},
+            "skin_tone": tuple(int(c) for c in skin_tone),
+            "centers": centers.round(2).tolist(),
+            "frames": self.frames,
+        }
+
+
+# Function to run a tracker over a frame source, yielding the smoothed result and achieved rate per frame
+def run_stream(frames, tracker, target_fps=10, source_fps=None):
+    start = time.perf_counter()
+    for processed, frame in enumerate(throttle(frames, target_fps, source_fps), start=1):
+        result = tracker.update(frame)
+        if result is not None:
+            yield {**result, "fps": processed / (time.perf_counter() - start)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Track skin undertone over a video file.")
+    parser.add_argument("video", help="Video file (animated GIF/WebP/APNG, or any format OpenCV reads)")
+    parser.add_argument("--fps", type=float, default=10, help="Target frames per second to analyze")
+    parser.add_argument("--source-fps", type=float, default=30, help="Frame rate of the file, to subsample by")
+    parser.add_argument("--window", type=int, default=15, help="Frames in the smoothing window")
+    parser.add_argument("--n-clusters", type=int, default=3)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tracker = StreamingSkinTone(args.n_clusters, args.window)
+    for update in run_stream(iter_video_frames(args.video), tracker, args.fps, args.source_fps):
+        print(json.dumps(update), flush=True)
+    print(f"{tracker.frames} frames analyzed", file=sys.stderr)
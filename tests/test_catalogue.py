@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import main
+from catalogue import HEADER, PaletteCatalogue, ReloadingCatalogue, write_catalogue
+
+
+# Function to replace a file the way a deployment would: write next to it and rename
+def replace_file(path, data):
+    with open(f"{path}.new", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.new", path)
+
+
+def test_catalogue_round_trips_palette_index(tmp_path):
+    path = str(tmp_path / "palettes.pcat")
+    write_catalogue(main.PALETTE_INDEX, path)
+    catalogue = PaletteCatalogue(path)
+
+    assert len(catalogue) == len(main.PALETTE_INDEX)
+    assert catalogue.n_colors == sum(len(colors) for colors in main.PALETTE_INDEX.values())
+    for key, colors in main.PALETTE_INDEX.items():
+        assert [dict(color) for color in catalogue[key]] == [dict(color) for color in colors]
+    with pytest.raises(KeyError):
+        catalogue[("Warm", "Green", "Purple")]
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:HEADER.size - 1],
+    lambda data: data[:len(data) // 2],
+    lambda data: b"NOPE" + data[4:],
+])
+def test_catalogue_rejects_broken_files(tmp_path, corrupt):
+    path = str(tmp_path / "palettes.pcat")
+    write_catalogue(main.PALETTE_INDEX, path)
+    with open(path, "rb") as f:
+        data = f.read()
+    replace_file(path, corrupt(data))
+    with pytest.raises(ValueError):
+        PaletteCatalogue(path)
+
+
+def test_reloading_catalogue_picks_up_replaced_file_and_keeps_old_on_error(tmp_path):
+    path = str(tmp_path / "palettes.pcat")
+    write_catalogue(main.PALETTE_INDEX, path)
+    reloading = ReloadingCatalogue(path, check_interval=0)
+    assert len(reloading.current()) == len(main.PALETTE_INDEX)
+
+    key = next(iter(main.PALETTE_INDEX))
+    write_catalogue({key: main.PALETTE_INDEX[key]}, path)
+    new = reloading.current()
+    assert list(new) == [key]
+    assert reloading.stats()["reloads"] == 1
+
+    replace_file(path, b"PCAT")
+    with pytest.warns(UserWarning, match="Keeping the current palette catalogue"):
+        assert reloading.current() is new
+    assert reloading.stats()["failed_reloads"] == 1
+    assert [dict(color) for color in reloading.current()[key]] == [dict(color) for color in main.PALETTE_INDEX[key]]
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+from PIL import Image
+
+import main
+
+
+# Function to encode a blank image of the given size as upload bytes
+def make_upload(width, height, image_format):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 150, 120)).save(buf, image_format)
+    return buf.getvalue()
+
+
+# Function to list, largest first, every size the decoder can produce for an image:
+# JPEG draft scales of 1/2, 1/4 and 1/8, then integer reduce factors of the last of those
+def decode_sizes(width, height, image_format):
+    sizes = [(width, height)]
+    if image_format == "JPEG":
+        sizes += [(-(-width // scale), -(-height // scale)) for scale in (2, 4, 8)]
+    base_width, base_height = sizes[-1]
+    sizes += [(-(-base_width // factor), -(-base_height // factor)) for factor in range(2, 65)]
+    return sizes
+
+
+@pytest.mark.parametrize("width, height, image_format", [
+    (3264, 2448, "JPEG"),
+    (3000, 2000, "JPEG"),
+    (3001, 2001, "JPEG"),
+    (3000, 2000, "PNG"),
+    (12000, 9000, "JPEG"),
+])
+def test_load_image_fits_decode_budget(width, height, image_format):
+    image = main.load_image(make_upload(width, height, image_format))
+    assert image.width * image.height <= main.DECODE_MAX_PIXELS
+    # Not shrunk further than needed: the next larger draft scale or reduce factor is over the budget
+    sizes = decode_sizes(width, height, image_format)
+    step = sizes.index(image.size)
+    assert step > 0
+    previous_width, previous_height = sizes[step - 1]
+    assert previous_width * previous_height > main.DECODE_MAX_PIXELS
+
+
+def test_load_image_keeps_small_images():
+    image = main.load_image(make_upload(800, 600, "JPEG"))
+    assert image.size == (800, 600)
@@ -0,0 +1,33 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import main
+
+
+# Function to list colours with many ties: every combination of a few channel values
+def make_grid(values):
+    return np.array(list(itertools.product(values, repeat=3)))
+
+
+@pytest.mark.parametrize("colors", [
+    np.random.default_rng(0).integers(0, 256, (20_000, 3)).astype(np.uint8),
+    make_grid(np.arange(0, 256, 15)).astype(np.uint8),
+    make_grid([0, 1, 2, 127, 128, 254, 255]).astype(np.uint8),
+    np.random.default_rng(1).uniform(0, 255, (20_000, 3)),
+    np.round(np.random.default_rng(2).uniform(0, 255, (20_000, 3)) * 2) / 2,
+    make_grid([0.0, 0.5, 1.0, 127.5, 128.0, 255.0]),
+])
+def test_classify_undertones_matches_scalar(colors):
+    labels = main.classify_undertones(colors)
+    expected = [main.classify_undertone(tuple(color)) for color in colors]
+    assert labels.tolist() == expected
+
+
+def test_classify_undertones_scores_agree_with_labels():
+    colors = make_grid(np.arange(0, 256, 15)).astype(np.uint8)
+    labels, scores = main.classify_undertones(colors, return_scores=True)
+    assert np.all(scores[labels == "Warm", 0] > 0)
+    assert np.all(scores[labels == "Cool", 1] > 0)
+    assert np.all(scores[labels == "Neutral", 2] >= 0)